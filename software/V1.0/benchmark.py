@@ -0,0 +1,52 @@
+# Imports
+import sys
+import time
+import numpy as np
+import astropy.units as u
+from astropy import constants as const
+from calibrations import VelocityCalibration
+from options import args
+
+# Benchmark of the unit-free Doppler kernel against the astropy Quantity implementation
+# Usage: python benchmark.py [files ...], Ex: python benchmark.py 10 100 1000
+
+CHANNELS = 4096
+REST_FREQUENCY = 6668.5192
+
+def QuantityDoppler(frequency, relative_velocity):
+  # Previous implementation, every step allocates unit carrying temporaries of the full matrix
+  observed_frequency = np.array([frequency]) * u.MHz
+  rest_frequency = REST_FREQUENCY * u.MHz
+  dr2 = (observed_frequency / rest_frequency) ** 2
+  observed_velocity = const.c * (1 - dr2) / (1 + dr2)
+  vlsrk = observed_velocity + relative_velocity * u.km / u.s
+  xvelo = np.array([]) * u.km / u.s
+  xvelo = np.append(xvelo, vlsrk)
+  return xvelo.reshape(np.shape(frequency))
+
+def KernelDoppler(frequency, relative_velocity, out):
+  # Unit-free kernel writing into a preallocated buffer, units attached at the end
+  return VelocityCalibration.DopplerKernel(frequency, REST_FREQUENCY, relative_velocity, out) << u.km / u.s
+
+def Time(function, *parameters, repeat=5):
+  # Best time of several runs
+  best = float('inf')
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = function(*parameters)
+    best = min(best, time.perf_counter() - start)
+  return best, result
+
+if __name__ == "__main__":
+  sizes = [int(size) for size in args] or [10, 100, 1000]
+  print(f'{"Channels":>10} {"Files":>8} {"Quantity [s]":>14} {"Kernel [s]":>12} {"Speedup":>9} {"Max diff [km/s]":>16}')
+  for files in sizes:
+    # Synthetic frequency matrix around the rest frequency and per file corrections
+    frequency = np.linspace(REST_FREQUENCY - 1, REST_FREQUENCY + 1, CHANNELS)[:, np.newaxis] + np.zeros(files)
+    relative_velocity = np.linspace(-30, 30, files)
+    out = np.empty_like(frequency)
+    quantity, reference = Time(QuantityDoppler, frequency, relative_velocity)
+    kernel, velocity = Time(KernelDoppler, frequency, relative_velocity, out)
+    difference = np.max(np.abs(velocity.value - reference.to_value(u.km / u.s)))
+    print(f'{CHANNELS:>10} {files:>8} {quantity:>14.4f} {kernel:>12.4f} {quantity / kernel:>8.1f}x {difference:>16.3e}')
+  sys.exit(0)
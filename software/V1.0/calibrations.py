@@ -1,7 +1,10 @@
 # Imports
 import numpy as np
 import sys
+import itertools
+import types
 import globals
+from concurrent.futures import ThreadPoolExecutor
 import astropy.units as u
 from options import o
 from astropy.time import Time
@@ -9,13 +12,37 @@ from astropy.coordinates import SkyCoord, EarthLocation, ICRS, LSRK, solar_syste
 from astropy import constants as const
 solar_system_ephemeris.set('de432s')
 
+class KernelThreads:
+  # Thread pool shared by the block kernels, NumPy releases the GIL in their inner loops so blocks run in parallel
+  threads = o.threads
+  executor = None
+  @classmethod
+  def Limit(cls, threads):
+    # Set the number of threads, worker processes use 1 as the processes already use every core
+    cls.threads = threads
+  @classmethod
+  def Blocks(cls, length, count=None):
+    # Split length files (or channels) into contiguous blocks, one per thread unless a count (workers, shards) is given
+    count = max(1, min(cls.threads if count is None else count, length))
+    return [slice(block[0], block[-1] + 1) for block in np.array_split(np.arange(length), count)]
+  @classmethod
+  def Map(cls, function, blocks):
+    # Run the function on every block, a single block runs in the calling thread
+    if len(blocks) == 1:
+      return [function(blocks[0])]
+    if cls.executor is None:
+      cls.executor = ThreadPoolExecutor(max_workers=cls.threads, thread_name_prefix='kernel')
+    return list(cls.executor.map(function, blocks))
+
 class ChannelCalibration:
   # Class to handle channel calibration based on input options
-  def __init__(self):
-    # Extract the channel range from the options
-    self.ch0, self.ch1 = o.channels.split(':')
+  def __init__(self, channels=None):
+    # Use the given channel range, otherwise fall back to the options
+    self.channels = channels or o.channels
+    # Extract the channel range
+    self.ch0, self.ch1 = self.channels.split(':')
     # If channels option is specified, set the channels
-    if o.channels:
+    if self.channels:
       self.SetChannels()  
   # Method to validate and set the channel range
   def SetChannels(self):
@@ -31,24 +58,32 @@ class ChannelCalibration:
           raise ValueError(f'CH1 Value is too large: {self.ch1}, Minimum: 4096')  # CH1 should be within a valid range (less than 4097)
     except (ValueError, Exception) as e: 
       # Handle errors
-      print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {o.channels}.')
+      print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {self.channels}.')
       quit()
    
 class PolarizationCalibration:
   # Class to handle polarization calibration
+  # Products calculated with -p A, in the order of the first axis of ysignal: R, L, normalized R+L and R-L
+  products = ('R', 'L', 'B', 'D')
   def __init__(self):
     # Initialize polarization value from options and convert to uppercase
     self.polarization = str(o.polarization).upper()
     self.pol_string = ''  # Initialize polarization string to empty
-  def Polarization(self, rhcp, lhcp):
+  def Polarization(self, rhcp, lhcp, extremes=None):
+    # Normalize both polarizations, using the extremes of the full data when only a block of files is given
+    def Both():
+      lmin, lmax, rmin, rmax = extremes or self.Extremes(rhcp, lhcp)
+      return np.array((
+          (lhcp - lmin) / (lmax - lmin),  # Normalize LHCP
+          (rhcp - rmin) / (rmax - rmin)   # Normalize RHCP
+      ))
     # Define a dictionary to map polarization types to corresponding descriptions and functions
     polarization_map = {
       'R': ('Right Hand Polarization', lambda: rhcp),  # Right Hand Circular Polarization
       'L': ('Left Hand Polarization', lambda: lhcp),   # Left Hand Circular Polarization
-      'B': ('Right and Left Hand Polarization', lambda: np.array((
-          (lhcp - np.min(lhcp)) / (np.max(lhcp) - np.min(lhcp)),  # Normalize LHCP
-          (rhcp - np.min(rhcp)) / (np.max(rhcp) - np.min(rhcp))   # Normalize RHCP
-      )))
+      'B': ('Right and Left Hand Polarization', Both),
+      # All products stacked into a (products, channels, files) array, so they share the velocity and bin indices
+      'A': ('All Polarization Products', lambda: self.Stack((rhcp, lhcp, np.add.reduce(Both(), axis=0), rhcp - lhcp)))
     }
     try:
       if self.polarization == 'B':
@@ -76,27 +111,51 @@ class PolarizationCalibration:
       print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {self.polarization}.')
       quit()
         
+  def Stack(self, signals):
+    # Stack (channels, files) signals with every file of every product contiguous, like the transposed loaded data
+    # The float32 reductions of the median calibration then round like they do for a single product
+    stacked = np.empty((len(signals),) + np.shape(signals[0])[::-1], dtype=np.result_type(*signals)).transpose(0, 2, 1)
+    for product, signal in zip(stacked, signals):
+      product[...] = signal
+    return stacked
+  def Products(self):
+    # The (channels, files) signal of every product, a single one unless all products are calculated
+    return list(self.ysignal) if np.ndim(self.ysignal) == 3 else [self.ysignal]
+  def Extremes(self, rhcp, lhcp):
+    # Minimum and maximum of both polarizations, used to normalize them
+    return np.min(lhcp), np.max(lhcp), np.min(rhcp), np.max(rhcp)
+  def MergeExtremes(self, extremes, rhcp, lhcp):
+    # Update the extremes with a block of files, None starts a new set of extremes
+    block = self.Extremes(rhcp, lhcp)
+    if extremes is None:
+      return block
+    return min(extremes[0], block[0]), max(extremes[1], block[1]), min(extremes[2], block[2]), max(extremes[3], block[3])
+        
 class MedianCalibration:
     # Class to handle the median calibration
     def __init__(self):
-      # Initialize an empty list to store spectra
-      self.spectra = []
+      # Median of every channel, set by Median
+      self.median = None
     def Median(self, ysignal):
       try:
-        # Subtract the mean of ysignal to center the data
-        ysignal -= np.mean(ysignal, axis=0)
-        # Append the centered ysignal to the spectra list
-        self.spectra.append(ysignal)
-        # Convert the spectra list to a NumPy array
-        self.spectra_array = np.array(self.spectra)
-        # Calculate the median of the spectra array
-        self.median = np.median(self.spectra_array, axis=2)
-        # Subtract the median (transposed) from the ysignal to remove median
-        ysignal -= self.median.T
+        # Subtract the mean of every file to center the data, in blocks of files
+        KernelThreads.Map(lambda block: self.Center(ysignal[:, block]), KernelThreads.Blocks(ysignal.shape[1]))
+        # Calculate the median of every channel and subtract it from the signal, in blocks of channels
+        self.median = np.empty(ysignal.shape[0], dtype=ysignal.dtype)
+        def Block(block):
+          self.median[block] = self.ChannelMedian(ysignal[block])
+          ysignal[block] -= self.median[block, np.newaxis]
+        KernelThreads.Map(Block, KernelThreads.Blocks(ysignal.shape[0]))
       except (Exception) as e: 
         # Handle errors
-        print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {self.spectra}.')
+        print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {np.shape(ysignal)}.')
         quit() 
+    def Center(self, ysignal):
+      # Subtract the mean of every file (column), blocks of files can be centered independently
+      ysignal -= np.mean(ysignal, axis=0)
+    def ChannelMedian(self, ysignal):
+      # Median of every channel (row) over the files, blocks of channels can be calculated independently
+      return np.median(ysignal, axis=1)
 
 class VelocityCalibration:
     # Class to handle the velocity calibration
@@ -120,119 +179,431 @@ class VelocityCalibration:
       self.telescopelocation = EarthLocation.from_geodetic(lat=self.latitude,
                                                            lon=self.longitude,
                                                            height=self.height)    
-      # Parse channel range from input options and calculate channel count
-      ch0, ch1 = map(int, o.channels.split(':'))
-      self.chancount = ch1 - ch0
-    def Velocity(self, frequency):
+      # Per file LSRK corrections, computed once on first use
+      self.corrections = None
+    def Corrections(self, columns=slice(None)):
+      # Calculate the LSRK radial velocity correction of the files (columns), later calls reuse the result
+      # Files that were not calculated yet are NaN, so a subset of the files can be corrected on its own
+      if self.corrections is None:
+        self.corrections = np.full(len(self.fitsdata.metadata), np.nan) * u.km / u.s
+      missing = np.arange(len(self.corrections))[columns]
+      missing = missing[np.isnan(self.corrections.value[missing])]
+      if len(missing) == 0:
+        return self.corrections
       try:
-        # Iterate over each file's metadata in the FITS data
-        for file, metadata in self.fitsdata.metadata.items():
+        corrections = []
+        # Create a SkyCoord object for the target coordinates (RA, DEC)
+        sc = SkyCoord(self.ra * u.deg, self.dec * u.deg, frame='icrs')
+        # Iterate over each missing file's metadata in the FITS data
+        for file in missing:
+          metadata = self.fitsdata.metadata[file]
           # Convert observation start and end times to Time objects
           start_utc = Time(metadata['DATE-OBS'])
           stop_utc = Time(metadata['DATE-END'])
           # Calculate the mid-point of the observation time
           mid_utc = (stop_utc - start_utc) / 2 + start_utc
-          # Create a SkyCoord object for the target coordinates (RA, DEC)
-          sc = SkyCoord(self.ra * u.deg, self.dec * u.deg, frame='icrs')
           # Calculate the barycentric radial velocity correction for the mid observation time and telescope location
           barycentric = sc.radial_velocity_correction(kind='barycentric', obstime=mid_utc, location=self.telescopelocation)
           # Create an ICRS object with the barycentric radial velocity correction
           icrs = ICRS(sc.ra, sc.dec, pm_ra_cosdec=0 * u.mas / u.yr, pm_dec=0 * u.mas / u.yr, radial_velocity=barycentric, distance=1 * u.pc)
           # Transform the ICRS object to the LSRK frame to get the relative velocity
           relative_velocity = icrs.transform_to(LSRK()).radial_velocity
-          # Convert the observed frequency to MHz
-          observed_frequency = np.array([frequency]) * u.MHz
-          # If a rest frequency is specified in the options, use it; otherwise, it defaults to None
-          if o.rfreq:
-              rest_frequency = o.rfreq * u.MHz
-          # Calculate the Doppler shift (dr2) for the observed and rest frequencies
-          dr2 = (observed_frequency / rest_frequency) ** 2
-          # Calculate the observed velocity using the Doppler formula
-          observed_velocity = const.c * (1 - dr2) / (1 + dr2)
-          # Calculate the LSRK velocity by adding the relative velocity to the observed velocity
-          vlsrk = observed_velocity + relative_velocity
-          # Initialize an empty array for the velocities in km/s
-          xvelo = np.array([]) * u.km / u.s
-          # Append the LSRK velocities to the velocity array
-          xvelo = np.append(xvelo, vlsrk)
-          # Reshape the velocity array to match the number of channels and FITS data count
-          self.velocity = xvelo.reshape((self.chancount, self.fitsdata.count))
+          corrections.append(relative_velocity.to_value(u.km / u.s))
+        # Store the corrections with one value per file (column)
+        self.corrections[missing] = np.array(corrections) * u.km / u.s
+        return self.corrections
+      except (Exception) as e:
+          # Handle errors
+          print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {self.fitsdata.files}.')
+          quit()
+    def __getstate__(self):
+      # Workers only need the metadata of the files to calculate corrections, the loaded data and velocities are not pickled
+      state = dict(self.__dict__)
+      state['fitsdata'] = types.SimpleNamespace(metadata=self.fitsdata.metadata, files=self.fitsdata.files)
+      state['velocity'] = []
+      return state
+    def StoreCorrections(self, columns, corrections):
+      # Store the corrections of the files (columns) calculated elsewhere, like in a worker, so they are not calculated again
+      # An empty selection only creates the array of corrections
+      self.Corrections(slice(0))
+      self.corrections[columns] = np.asarray(corrections) * u.km / u.s
+    def Velocity(self, frequency, rfreq=None):
+      # Calculate and store the LSRK velocity of the frequency data
+      self.velocity = self.Doppler(frequency, rfreq)
+    def Doppler(self, frequency, rfreq=None, columns=slice(None), out=None):
+      try:
+        # Retrieve the per file LSRK corrections of the files (columns) in the frequency data
+        relative_velocity = self.Corrections(columns)[columns].to_value(u.km / u.s)
+        # Use the given rest frequency, otherwise the one specified in the options
+        rest_frequency = rfreq or o.rfreq
+        # Calculate the velocities as plain floats, units are only attached to the result
+        velocity = self.DopplerKernel(np.asarray(frequency), rest_frequency, relative_velocity, out)
+        return velocity << u.km / u.s
       except (Exception) as e:
           # Handle errors
           print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {frequency}.')
           quit()
+    @staticmethod
+    def DopplerKernel(frequency, rest_frequency, relative_velocity, out=None):
+      # Relativistic Doppler velocity [km/s] of a (channels, files) frequency [MHz] array plus the per file corrections
+      # Calculated in place in blocks of rows, so the only temporary is one block
+      if out is None:
+        out = np.empty(np.shape(frequency), dtype=np.float64)
+      c = const.c.to_value(u.km / u.s)
+      rows = max(1, globals.KERNEL_BLOCK_SIZE // max(1, out[0].size if out.ndim > 1 else 1))
+      temp = np.empty_like(out[:rows])
+      for start in range(0, len(out), rows):
+        block = out[start:start + rows]
+        scratch = temp[:len(block)]
+        # Calculate the Doppler shift (dr2) for the observed and rest frequencies
+        np.divide(frequency[start:start + rows], rest_frequency, out=block)
+        np.square(block, out=block)
+        # Calculate the observed velocity using the Doppler formula, c * (1 - dr2) / (1 + dr2)
+        np.subtract(1, block, out=scratch)
+        block += 1
+        np.divide(scratch, block, out=block)
+        block *= c
+        # Calculate the LSRK velocity by adding the relative velocity of each file to its column
+        block += relative_velocity
+      return out
             
 class RegridCalibration:
   # Class to handle the re-grid calibration  
-  def __init__(self):
-    # Initialize sum_ch to None; it will store the sum of all y arrays
-    self.sum_ch = None
-    # Set the number of frequency and velocity bins from options, if specified
-    if o.bins:
-        self.num_freq, self.num_velo = o.bins, o.bins
+  def __init__(self, bins=None):
+    # Set the number of frequency and velocity bins, falling back to the options
+    self.bins = bins or o.bins
+    if self.bins:
+        self.num_freq, self.num_velo = self.bins, self.bins
     # Initialize the minimum and maximum frequency and velocity values
     self.min_freq = float('inf')
     self.max_freq = float('-inf')
     self.min_velo = float('inf')
     self.max_velo = float('-inf')
+    # Fixed grids given in the options replace the grids derived from the data, and their bin counts
+    # A fixed grid is given by its bin edges, the bins are labelled by their centres
+    self.freq_edges = self.Grid(o.fgrid) if o.fgrid else None
+    self.velo_edges = self.Grid(o.vgrid) if o.vgrid else None
+    self.fixed_freq = (self.freq_edges[:-1] + self.freq_edges[1:]) / 2 if o.fgrid else None
+    self.fixed_velo = (self.velo_edges[:-1] + self.velo_edges[1:]) / 2 if o.vgrid else None
+    if self.fixed_freq is not None:
+      self.freq_fr, self.num_freq = self.fixed_freq, len(self.fixed_freq)
+      self.min_freq, self.max_freq = self.freq_edges[0], self.freq_edges[-1]
+    if self.fixed_velo is not None:
+      self.velo_fr, self.num_velo = self.fixed_velo, len(self.fixed_velo)
+      self.min_velo, self.max_velo = self.velo_edges[0], self.velo_edges[-1]
+    # Per file weights and the excluded channels, set by Select; weighted counts are sums of the weights
+    self.weights = None
+    self.ch0 = 0
+    self.masked = self.Mask(o.mask) if o.mask else None
+    self.count_type = float if o.weight else int
+    # With -p A the sums hold one row per polarization product, the counts are shared by the products
+    self.products = len(PolarizationCalibration.products) if str(o.polarization).upper() == 'A' else None
     # Initialize arrays to store the sum and count for frequency and velocity
-    self.sum_fr = np.zeros(self.num_freq)
-    self.sum_vr = np.zeros(self.num_velo)
-    self.count_fr = np.zeros(self.num_freq, dtype=int)
-    self.count_vr = np.zeros(self.num_velo, dtype=int)
+    self.sum_fr = np.zeros((self.products, self.num_freq) if self.products else self.num_freq)
+    self.sum_vr = np.zeros((self.products, self.num_velo) if self.products else self.num_velo)
+    self.count_fr = np.zeros(self.num_freq, dtype=self.count_type)
+    self.count_vr = np.zeros(self.num_velo, dtype=self.count_type)
     # Initialize variables to store the average frequency and velocity
     self.average_fr = None
     self.average_vr = None
+    # Initialize the dynamic spectrum, only calculated when requested
+    self.dynamic = None
+    self.dynamic_sum = None
+    self.dynamic_count = None
     
+  def Grid(self, grid):
+    # Parse a min:max:step grid option into the bin edges min, min + step, ..., up to max when the range is a whole number of steps
+    try:
+      start, stop, step = map(float, grid.split(':'))
+      if step <= 0 or stop - start < step * (1 - 1e-9):
+        raise ValueError(f'Grid needs min < max and a positive step of at most max - min: {grid}')
+      return start + step * np.arange(int(np.floor((stop - start) / step + 1e-9)) + 1)
+    except (ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {grid}.')
+      quit()
+
+  def Mask(self, mask):
+    # Parse comma separated CH:CH ranges into a mask of the excluded channels
+    try:
+      masked = np.zeros(4096, dtype=bool)
+      for channels in mask.split(','):
+        ch0, ch1 = map(int, channels.split(':'))
+        if not 0 <= ch0 < ch1 <= 4096:
+          raise ValueError(f'Invalid channel range: {channels}')
+        masked[ch0:ch1] = True
+      return masked
+    except (ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {mask}.')
+      quit()
+
+  def SetData(self, metadata, ch0):
+    # Set the weight of every file from its metadata and the channel of the first row of the data
+    self.ch0 = ch0
+    if o.weight == 'time':
+      # Integration time of the file in seconds
+      self.weights = (metadata.columns['DATE-END'] - metadata.columns['DATE-OBS']) / np.timedelta64(1, 's')
+    elif o.weight == 'elevation':
+      # Sine of the start elevation, the inverse of the airmass
+      self.weights = np.sin(np.radians(metadata.columns['EL-BEG'].astype(float)))
+
+  def FileWeights(self, columns):
+    # Weights of the files (columns), None when every file has the same weight
+    return None if self.weights is None else self.weights[columns]
+
+  def Fixed(self):
+    # True when both grids are fixed, the data extremes are then not needed
+    return self.fixed_freq is not None and self.fixed_velo is not None
+
   def MinMaxRange(self, x_v, x_f):
-    # Calculate the minimum and maximum values for frequency and velocity from the input arrays
-    get_min_freq, get_max_freq = np.min(x_f), np.max(x_f)
-    get_min_velo, get_max_velo = np.min(x_v), np.max(x_v)
-    # Update the class attributes to reflect the overall min and max values
-    self.min_freq = min(self.min_freq, get_min_freq)
-    self.max_freq = max(self.max_freq, get_max_freq)
-    self.min_velo = min(self.min_velo, get_min_velo)
-    self.max_velo = max(self.max_velo, get_max_velo)
-    # Create evenly spaced arrays for frequency and velocity based on the min and max values
-    self.freq_fr = np.linspace(self.min_freq, self.max_freq, self.num_velo)
-    self.velo_fr = np.linspace(self.min_velo, self.max_velo, self.num_velo)
+    # Calculate the minimum and maximum values for frequency and velocity from the input arrays, fixed grids are kept
+    if self.fixed_freq is None:
+      get_min_freq, get_max_freq = np.min(x_f), np.max(x_f)
+      # Update the class attributes to reflect the overall min and max values
+      self.min_freq = min(self.min_freq, get_min_freq)
+      self.max_freq = max(self.max_freq, get_max_freq)
+      # Create an evenly spaced array for frequency based on the min and max values
+      self.freq_fr = np.linspace(self.min_freq, self.max_freq, self.num_freq)
+    if self.fixed_velo is None:
+      get_min_velo, get_max_velo = np.min(x_v), np.max(x_v)
+      self.min_velo = min(self.min_velo, get_min_velo)
+      self.max_velo = max(self.max_velo, get_max_velo)
+      # Create an evenly spaced array for velocity based on the min and max values
+      self.velo_fr = np.linspace(self.min_velo, self.max_velo, self.num_velo)
     
   def Regrid(self, x_v, x_f, y, filecount):
     try:
-      # Initialize count to 0 for the first iteration
-      count = 0
       # Update the min and max ranges for frequency and velocity
       self.MinMaxRange(x_v, x_f)
-      # If this is the first iteration, copy y to sum_ch; otherwise, add y to sum_ch
-      if count == 0:
-        self.sum_ch = np.copy(y)
-      else:
-        self.sum_ch += y
-      # Loop over the frequency channels in y
-      for fch in range(len(y)):
-        # Find the index in freq_fr where x_f[fch] should be inserted
-        ffi = np.searchsorted(self.freq_fr, x_f[fch])
-        # Update the sum and count arrays for frequency
-        self.sum_fr[ffi] += y[fch]
-        self.count_fr[ffi] += 1
-      # Loop over the velocity channels in y
-      for vch in range(len(y)):
-        # Find the index in velo_fr where x_v[vch] should be inserted
-        vfi = np.searchsorted(self.velo_fr, x_v[vch])
-        # Update the sum and count arrays for velocity
-        self.sum_vr[vfi] += y[vch]
-        self.count_vr[vfi] += 1
-      # Initialize an array to store the average values for channels
-      average_ch = np.zeros_like(len(self.sum_ch))
-      # Calculate the average values for channels
-      for i in range(average_ch):
-        average_ch[i] = self.sum_ch[i] / filecount
-      # Suppress warnings for division by zero and invalid values
-      with np.errstate(divide='ignore', invalid='ignore'):
-        # Calculate the average frequency and velocity by dividing the sum by the count
-        self.average_fr = np.divide(self.sum_fr, self.count_fr) 
-        self.average_vr = np.divide(self.sum_vr, self.count_vr)
+      # Accumulate every channel of every file onto the grids
+      self.Partial(x_v, x_f, y)
+      # Calculate the averages from the accumulated sums and counts
+      self.Average()
     except (Exception) as e:
       # Handle errors
       print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {x_v}, {x_f}, {y}.')
-      quit()
\ No newline at end of file
+      quit()
+
+  def Partial(self, x_v, x_f, y, columns=slice(None)):
+    # Accumulate a block of files onto the current grids, blocks can be accumulated in any order
+    # The columns give the files of the block, for their weights
+    weights = self.FileWeights(columns)
+    # The files are split over the kernel threads, each accumulating its own partial sums and counts
+    for sum_fr, count_fr, sum_vr, count_vr in KernelThreads.Map(lambda block: self.BlockPartial(x_v[:, block], x_f[:, block], y[..., block], None if weights is None else weights[block]), KernelThreads.Blocks(np.shape(y)[-1])):
+      self.sum_fr += sum_fr
+      self.count_fr += count_fr
+      self.sum_vr += sum_vr
+      self.count_vr += count_vr
+
+  def BlockPartial(self, x_v, x_f, y, weights=None):
+    # Find the bin of every channel of every file and accumulate them in one vectorized pass
+    ffi = self.BinIndex(self.freq_fr, x_f)
+    vfi = self.BinIndex(self.velo_fr, x_v)
+    # The weighted signal and the weights are calculated once and shared by both grids
+    y, counted = self.Weigh(y, weights, np.shape(ffi))
+    return (self.Accumulate(ffi, y, self.num_freq), self.Accumulate(ffi, counted, self.num_freq).astype(self.count_type),
+            self.Accumulate(vfi, y, self.num_velo), self.Accumulate(vfi, counted, self.num_velo).astype(self.count_type))
+
+  def Merge(self, other):
+    # Add the partial sums and counts of another RegridCalibration on the same grids
+    self.sum_fr += other.sum_fr
+    self.count_fr += other.count_fr
+    self.sum_vr += other.sum_vr
+    self.count_vr += other.count_vr
+    if other.dynamic_sum is not None:
+      self.dynamic_sum += other.dynamic_sum
+      self.dynamic_count += other.dynamic_count
+
+  def SavePartial(self, path, **extra):
+    # Save the grids, sums and counts of this partial regrid to a .npz file (format described in the README)
+    partial = {
+      'version': 1,
+      'freq_fr': u.Quantity(self.freq_fr).value,
+      'velo_fr': u.Quantity(self.velo_fr).value,
+      'sum_fr': self.sum_fr,
+      'count_fr': self.count_fr,
+      'sum_vr': self.sum_vr,
+      'count_vr': self.count_vr
+    }
+    if self.dynamic_sum is not None:
+      partial['dynamic_sum'] = self.dynamic_sum
+      partial['dynamic_count'] = self.dynamic_count
+    np.savez(path, **partial, **extra)
+
+  def MergePartial(self, path):
+    # Add the sums and counts of a partial regrid saved by SavePartial, its grids must match this regrid
+    with np.load(path) as partial:
+      if not (np.array_equal(partial['freq_fr'], u.Quantity(self.freq_fr).value) and np.array_equal(partial['velo_fr'], u.Quantity(self.velo_fr).value)):
+        raise ValueError(f'Partial regrid {path} is on a different grid')
+      self.sum_fr += partial['sum_fr']
+      self.count_fr += partial['count_fr']
+      self.sum_vr += partial['sum_vr']
+      self.count_vr += partial['count_vr']
+      if 'dynamic_sum' in partial:
+        self.dynamic_sum += partial['dynamic_sum']
+        self.dynamic_count += partial['dynamic_count']
+      # Return the remaining entries, for example the file count of the partial
+      return {key: partial[key] for key in partial.files}
+
+  def Average(self):
+    # Suppress warnings for division by zero and invalid values
+    with np.errstate(divide='ignore', invalid='ignore'):
+      # Calculate the average frequency and velocity by dividing the sum by the count
+      self.average_fr = np.divide(self.sum_fr, self.count_fr) 
+      self.average_vr = np.divide(self.sum_vr, self.count_vr)
+      # Calculate the dynamic spectrum if it is accumulated
+      if self.dynamic_sum is not None:
+        self.dynamic = np.divide(self.dynamic_sum, self.dynamic_count)
+
+  def BinIndex(self, grid, x):
+    # Find the index in the grid where every value of x should be inserted
+    edges = self.freq_edges if grid is self.fixed_freq else self.velo_edges if grid is self.fixed_velo else None
+    grid, x = u.Quantity(grid).value, u.Quantity(x).value
+    if edges is None:
+      index = np.searchsorted(grid, x)
+    else:
+      # A fixed grid bin holds the values from its lower edge up to, but not including, its upper edge
+      index = np.searchsorted(edges, x, side='right') - 1
+      # Values outside a fixed grid go to the overflow bin past the last bin, which Accumulate drops
+      index[(index < 0) | (index >= len(grid))] = len(grid)
+    # Excluded channels (rows) go to the overflow bin as well
+    if self.masked is not None and np.ndim(index) == 2:
+      index[self.masked[self.ch0:self.ch0 + len(index)]] = len(grid)
+    return index
+
+  def Weigh(self, y, weights, shape):
+    # Weighted y and the flat weight of every entry of a block with the given shape, None weights leave y unchanged
+    # The counts of weighted entries are the sums of their weights, so the weights are summed instead of counted
+    if weights is None:
+      return y, None
+    return np.multiply(y, weights), np.broadcast_to(weights, shape).ravel()
+
+  def Accumulate(self, index, y, length):
+    # Sum y (or count the entries when y is None) into the bins given by index, dropping the overflow bin
+    # Several products share the bin indices, every product is offset to its own row of bins in a single bincount
+    if y is not None and np.ndim(y) > np.ndim(index):
+      index = index + (length + 1) * np.arange(len(y)).reshape((-1,) + (1,) * np.ndim(index))
+      return np.bincount(np.ravel(index), weights=np.ravel(y), minlength=len(y) * (length + 1)).reshape(len(y), length + 1)[:, :length]
+    return np.bincount(np.ravel(index), weights=None if y is None else np.ravel(y), minlength=length + 1)[:length]
+
+  @staticmethod
+  def Nights(starts):
+    # A night runs from noon to noon so observations across midnight stay together, shared by the dynamic spectrum, the rollups and the inventory
+    return (starts - np.timedelta64(12, 'h')).astype('datetime64[D]')
+
+  def Buckets(self, metadata):
+    # Group the files (columns) into time buckets, one per file or one per observing night
+    starts = metadata.columns['DATE-OBS']
+    if o.dynamic == 'night':
+      keys = self.Nights(starts)
+    else:
+      keys = starts
+    # Unique sorted bucket labels and the bucket of every file
+    return np.unique(keys, return_inverse=True)
+
+  def Epochs(self, metadata):
+    # Set the time buckets of the files
+    self.epochs, self.buckets = self.Buckets(metadata)
+    # Initialize the (epochs, bins) sums and counts of the dynamic spectrum
+    self.dynamic_sum = np.zeros((len(self.epochs), self.num_velo))
+    self.dynamic_count = np.zeros((len(self.epochs), self.num_velo), dtype=self.count_type)
+
+  def EpochRows(self, x_v, y, buckets, weights=None):
+    # Accumulate a block of files into rows for the buckets from the first to the last bucket of the block
+    # Combine the bucket of each file (column) and the bin of each channel into one flat index
+    first = int(np.min(buckets))
+    rows = int(np.max(buckets)) - first + 1
+    bins = self.BinIndex(self.velo_fr, x_v)
+    index = (buckets[np.newaxis, :] - first) * self.num_velo + bins
+    length = rows * self.num_velo
+    # Values outside a fixed grid and excluded channels go to the overflow bin past the last bucket
+    if self.fixed_velo is not None or self.masked is not None:
+      index[bins == self.num_velo] = length
+    y, counted = self.Weigh(y, weights, np.shape(index))
+    sums = self.Accumulate(index, y, length).reshape(rows, self.num_velo)
+    counts = self.Accumulate(index, counted, length).reshape(rows, self.num_velo).astype(self.count_type)
+    return first, sums, counts
+
+  def DynamicPartial(self, x_v, y, columns=slice(None)):
+    # Accumulate a block of files (columns) with their buckets into the dynamic spectrum
+    first, sums, counts = self.EpochRows(x_v, y, self.buckets[columns], self.FileWeights(columns))
+    self.dynamic_sum[first:first + len(sums)] += sums
+    self.dynamic_count[first:first + len(counts)] += counts
+
+  def DynamicSpectrum(self, x_v, y, metadata):
+    # Regrid every time bucket onto the velocity grid shared with Regrid, giving an (epochs, bins) array
+    try:
+      self.Epochs(metadata)
+      self.DynamicPartial(x_v, y)
+      self.Average()
+    except (Exception) as e:
+      # Handle errors
+      print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {x_v}, {y}.')
+      quit()
+
+class SweepCalibration:
+  # Class to expand the sweep options into combinations of channel ranges, rest frequencies and bins
+  def __init__(self):
+    try:
+      # Channel ranges are comma separated, unspecified sweeps fall back to the single value from the options
+      self.channels = o.sweepchannels.split(',') if o.sweepchannels else [o.channels]
+      self.rfreqs = self.SweepValues(o.sweeprfreq, float) if o.sweeprfreq else [o.rfreq]
+      self.bins = self.SweepValues(o.sweepbins, int) if o.sweepbins else [o.bins]
+      # Validate every channel range before any processing is started
+      for channels in self.channels:
+        ChannelCalibration(channels)
+      # Every combination of channel range, rest frequency and bin count
+      self.combinations = list(itertools.product(self.channels, self.rfreqs, self.bins))
+    except (ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {o.sweepchannels}, {o.sweeprfreq}, {o.sweepbins}.')
+      quit()
+  def SweepValues(self, values, cast):
+    # Expand a comma separated list of values and start:stop:step ranges (stop inclusive)
+    expanded = []
+    for value in values.split(','):
+      if ':' in value:
+        start, stop, step = map(cast, value.split(':'))
+        if step <= 0:
+          raise ValueError(f'Sweep step is invalid: {value}')
+        expanded.extend(cast(v) for v in np.arange(start, stop + step / 2, step))
+      else:
+        expanded.append(cast(value))
+    return expanded
+  def Window(self):
+    # Smallest channel range covering every combination, used to limit the rows read from the files
+    ranges = [ChannelCalibration(channels) for channels, _, _ in self.combinations]
+    return f'{min(cut.ch0 for cut in ranges)}:{max(cut.ch1 for cut in ranges)}'
+  def Summary(self, combination, regrid):
+    # Summarize a single regridded combination as a row of the sweep table
+    # The bin count of the regrid, a fixed velocity grid replaces the bins of the combination
+    channels, rfreq, _ = combination
+    velocity = u.Quantity(regrid.velo_fr, u.km / u.s).value
+    with np.errstate(invalid='ignore'):
+      peak = np.nanargmax(regrid.average_vr) if np.any(regrid.count_vr) else 0
+    return {
+      'CHRANGE': channels,
+      'RESTFREQ': rfreq,
+      'NUMBINS': regrid.num_velo,
+      'PEAK_VELO': float(velocity[peak]),
+      'PEAK_POWER': float(regrid.average_vr[peak]),
+      'FILLED_BINS': int(np.count_nonzero(regrid.count_vr))
+    }
+
+class LineCalibration(SweepCalibration):
+  # Class to expand the lines option into one rest frequency and channel window per spectral line
+  def __init__(self):
+    try:
+      self.combinations = []
+      # Lines are comma separated, each given as restfreq:ch0:ch1
+      for line in o.lines.split(','):
+        rfreq, ch0, ch1 = line.split(':')
+        channels = f'{ch0}:{ch1}'
+        # Validate the channel window of the line
+        ChannelCalibration(channels)
+        self.combinations.append((channels, float(rfreq), o.bins))
+    except (ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error: {e},\nOccurred in: {sys._getframe().f_code.co_name},\nWith: {o.lines}.')
+      quit()
@@ -1,9 +1,18 @@
 # Imports
 import os
 import sys
+import json
 import time
+import atexit
+import signal
+import fnmatch
 import globals
+import calibrations
 import numpy as np
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
 from datetime import datetime, timedelta
 from astropy.io import fits
 from astropy.table import Table
@@ -11,10 +20,16 @@ from options import o
 
 class FITSHandler:
   # FITSHandler Constructor
-  def __init__(self, directory): # Constructor
+  def __init__(self, directory, channels=None, load=True, filter=True, times=True, index=None): # Constructor
     try:
       # Set the directory attribute
       self.directory = directory
+      # Index of headers read before, like the one of a RollupStore, only the files missing from it are read
+      self.index = index
+      # Apply the start and end time when filtering, otherwise the caller selects the times itself
+      self.times = times
+      # Range of channels (rows) to read from each file, only these rows are decoded
+      self.ch0, self.ch1 = map(int, (channels or o.channels).split(':'))
       # Validate that the provided directory is an actual directory
       if not os.path.isdir(self.directory):
         # If not a directory, raise NotADirectoryError
@@ -26,19 +41,26 @@ class FITSHandler:
       self.channels = [] # List to store channel data from FITS files
       self.rhcp = [] # List to store RHCP data from FITS files
       self.lhcp = [] # List to Store LHCP dataa from FITS files
-      # Initialize a directory to store metadata for each FITS file
-      self.metadata = {}
+      # Initialize the metadata of the FITS files, loaded as a MetadataTable
+      self.metadata = None
       
       # Initialize counters and process start time
       self.filecount = 0 # Count of valid FITS files
       self.count = 0 # Count of processed FITS files
       self.process = time.time() # Record the start time of the processing 
+      self.iowait = 0 # Time spent waiting on file reads
       
       # Call methods to handle different tasks
       self.HandleDirectory() # Process the directory and gather FITS files
       self.HandleLoadMetaData() # Load metadata from the FITS files
-      self.HandleFilterFiles() # Filter files based on certain criteria
-      self.HandleLoadData() # Load data from the filtered FITS files
+      # Filter files based on certain criteria, unless every file is kept
+      if filter:
+        self.HandleFilterFiles()
+      else:
+        self.filecount = len(self.files)
+      # Load data from the filtered FITS files, unless it is loaded later in chunks
+      if load:
+        self.HandleLoadData()
     except(NotADirectoryError, Exception) as e:
       # Handle errors
       print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.directory}.')
@@ -46,20 +68,16 @@ class FITSHandler:
     
   def HandleDirectory(self):
     try:
-      # Walk through the directory tree from bottom to top
-      for root, dirs, files in os.walk(self.directory, topdown=False):
-        # Iterate over each file in the current directory
-        for file in files:
-          # Check if the file has a '.fits' extension
-          if file.endswith('.fits'):
-            # Construct the full path to the file
-            full_path = os.path.join(root, file)
-            # Add the full path to the list of FITS files
-            self.files.append(full_path)
-          else:
-            # Inform that the file is not a FITS file and ignore it
-            print(f'File: {file} is not a FITS file, it was ignored')
-            continue
+      # Discover the FITS files of the directory tree, scanning the subdirectories concurrently
+      scanner = DirectoryScanner(self.directory, o.include, o.exclude, o.depth, o.scanthreads)
+      self.files = scanner.Scan()
+      # Report the skipped entries once, instead of a line for every file
+      if scanner.skipped:
+        print(f'Files: {scanner.skipped} ignored, not FITS files or not matching the include/exclude patterns')
+      if scanner.unreadable:
+        print(f'Directories: {scanner.unreadable} could not be read and were ignored')
+      self.discovertime = scanner.time
+      print(f'Time to discover : {self.discovertime:.4f}s ({len(self.files)} files in {scanner.directories} directories)')
     except (Exception) as e:
       # Handle errors
       print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.directory}.')
@@ -67,70 +85,80 @@ class FITSHandler:
           
   def HandleLoadMetaData(self):
     try:
-      # Iterate over the list of files with their index
-      for idx, file in enumerate(self.files):
-        # Check if the list of files is empty or not properly set  
-        if self.files is None or self.files == 0:
-          # Raise an error if no files are detected
-          raise FileNotFoundError(f'No files detected: {self.files}')
-        # Load metadata from the current FITS file
-        metadata = self.LoadMetaData(file)
+      # Check if the list of files is empty or not properly set  
+      if not self.files:
+        # Raise an error if no files are detected
+        raise FileNotFoundError(f'No files detected: {self.files}')
+      records = []
+      # Headers found in the index are not read again
+      indexed, known = self.index.Lookup(self.files) if self.index is not None else (None, np.zeros(len(self.files), dtype=bool))
+      files = [file for file, found in zip(self.files, known) if not found]
+      # Read the headers in parallel worker processes, the header parsing is bound by the interpreter rather than I/O
+      # LoadMetaData is static, so only the file names are sent to the workers
+      if o.workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=o.workers) as executor:
+          loaded = list(executor.map(self.LoadMetaData, files, chunksize=max(1, len(files) // (o.workers * 4))))
+      else:
+        loaded = map(self.LoadMetaData, files)
+      # Iterate over the metadata of every file read, in the order of the files
+      for file, metadata in zip(files, loaded):
         # Check if metadata was successfully retrieved
         if metadata is not None:
-          # Store the metadata in the dictionary with the file index as the key
-          self.metadata[idx] = metadata
+          records.append(metadata)
         else:
           # Raise an error if metadata is empty
           raise ValueError(f'Metadata is empty {metadata}')
+      # Store the metadata as columns with one row per file, in the order of the files
+      self.metadata = MetadataTable(records) if records else None
+      if self.index is not None:
+        if records:
+          self.index.Update(self.metadata)
+        # Indexed rows come first, they are put back in the order of the files
+        if indexed is not None:
+          self.metadata = MetadataTable.Concatenate([indexed, self.metadata]) if records else indexed
+          order = np.argsort(np.concatenate([np.flatnonzero(known), np.flatnonzero(~known)]), kind='stable')
+          self.metadata = self.metadata.Select(order)
+        print(f'Headers: {len(files)} read, {len(self.files) - len(files)} from the index')
     except (FileNotFoundError, ValueError, Exception) as e:
       # Handle errors
-      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {file}.')
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {locals().get("file", self.directory)}.')
       quit()
     
   def HandleFilterFiles(self):
     # Filter files method
     try:
-      # Initialize lists and dictionaries to store valid files and their metadata
-      valid_files = []
-      valid_metadata = {}
+      columns = self.metadata.columns
       # Parse the center frequency range from options and convert to float 
       cfrl, cfru = o.cfreq.split(':')
       cfrl = float(cfrl) if cfrl else 0
       cfru = float(cfru) if cfru else 1e20
       lower_threshold, upper_threshold = float(cfrl), float(cfru)
-      # Iterate over files and their corresponding metadata
-      for idx, file in enumerate(self.files):
-        metadata = self.metadata[idx]
-        # Check if the file's observation dates are within the specified range
-        if (metadata['DATE-OBS'] <= datetime.strptime(str(o.start),'%Y-%m-%dT%H:%M:%S') 
-          or
-          metadata['DATE-END'] >= datetime.strptime(str(o.end),'%Y-%m-%dT%H:%M:%S')):
-          print(f'File: {file} ignored due to out of range start/end time: {metadata["DATE-OBS"]} - {metadata["DATE-END"]}')
-          continue # Skip files that do not meet the time range criteria
-        # Check if the file's center frequency is within the specified range
-        elif not lower_threshold < metadata['FREQ'] < upper_threshold:
-          print(f'File: {self.files[idx]} ignored due to out of range centre frequency: {metadata["FREQ"]}')
-          continue # Skip files that do not meet the frequency range criteria
-        # Check if the telescope used matches the specified telescope
-        elif metadata['TELESCOP'] != o.telescope:
-          print(f'File: {self.files[idx]} ignored due to incorrect telescope used: {metadata["TELESCOP"]}')
-          continue # Skip files that do not match the specified telescope
-        # Check if the elevation during observation meets the minimum required
-        elif metadata['EL-BEG'] < o.elevation:
-          print(f'File: {self.files[idx]} ignored due to elevation during observation: {metadata["EL-BEG"]}')
-          continue # Skip files with insufficient elevation during observation
-        else:
-          # If all criteria are met, add the file and its metadata to the valid lists
-          valid_files.append(self.files[idx])
-          valid_metadata[len(valid_files) - 1] = metadata
-      # If start or end time filters are specified, sort the valid files by their observation start time        
+      # Parse the start and end times once for all files
+      start = np.datetime64(datetime.strptime(str(o.start),'%Y-%m-%dT%H:%M:%S'))
+      end = np.datetime64(datetime.strptime(str(o.end),'%Y-%m-%dT%H:%M:%S'))
+      # Evaluate every criterion for all files at once, in the order they are reported
+      criteria = [
+        ('out of range start/end time', (columns['DATE-OBS'] > start) & (columns['DATE-END'] < end)),
+        ('out of range centre frequency', (lower_threshold < columns['FREQ']) & (columns['FREQ'] < upper_threshold)),
+        ('incorrect telescope used', columns['TELESCOP'] == o.telescope),
+        ('elevation during observation', columns['EL-BEG'] >= o.elevation)
+      ]
+      if not self.times:
+        criteria.pop(0)
+      valid = np.ones(len(self.metadata), dtype=bool)
+      for reason, mask in criteria:
+        # Files are counted for the first criterion they fail
+        ignored = np.count_nonzero(valid & ~mask)
+        if ignored:
+          print(f'Files: {ignored} ignored due to {reason}')
+        valid &= mask
+      # Sort the valid files by their observation start time, keeping the file order for equal times
+      indices = np.flatnonzero(valid)
       if o.start or o.end:
-        sorted_metadata = sorted(zip(valid_files, valid_metadata.values()), key=lambda x: x[1]['DATE-OBS'])
-        valid_files, sorted_metadata = zip(*sorted_metadata)
-        valid_metadata = {i: meta for i, meta in enumerate(sorted_metadata)}
+        indices = indices[np.argsort(columns['DATE-OBS'][indices], kind='stable')]
       # Update the class attributes with the filtered lists of files and metadata
-      self.files = list(valid_files)
-      self.metadata = valid_metadata
+      self.metadata = self.metadata.Select(indices)
+      self.files = [self.files[idx] for idx in indices]
       # Update file count and raise an error if no valid files are found 
       self.filecount = len(self.files)
       if self.filecount == 0:
@@ -143,7 +171,8 @@ class FITSHandler:
   def HandleLoadData(self):
     # Handle the loading of data
     try:
-      # Iterate over the list of valid FITS files
+      # Validate the list of valid FITS files before any file is read
+      files = []
       for file in self.files:
         # Check if the file path is a valid file
         if not os.path.isfile(file):
@@ -153,15 +182,18 @@ class FITSHandler:
           print(f'Warning: {file} is not a FITS file')
           continue # Ignore files that do not end with '.fits'
         else:
-          # Load data from the FITS file
-          frequency, channels, rhcp, lhcp = self.LoadFitsData(file)
-          # Append the loaded data to the corresponding class attributes
-          self.frequencies.append(frequency)
-          self.channels.append(channels)
-          self.rhcp.append(rhcp)
-          self.lhcp.append(lhcp)
-          # Increment the count of successfully processed files
-          self.count += 1
+          files.append(file)
+      start = time.time()
+      # Load data from the FITS files, the next files are read in the background while the current one is handled
+      for frequency, channels, rhcp, lhcp in self.Prefetch(self.LoadFitsData, files):
+        # Append the loaded data to the corresponding class attributes
+        self.frequencies.append(frequency)
+        self.channels.append(channels)
+        self.rhcp.append(rhcp)
+        self.lhcp.append(lhcp)
+        # Increment the count of successfully processed files
+        self.count += 1
+      self.ReportLoad(start)
       # Check if the number of processed files is less than 5        
       if len(self.files) < 5:
         print('Warning: Low file count, results may vary')
@@ -169,21 +201,61 @@ class FITSHandler:
       # Handle errors
       print(f'Error: {e},\nOccured in: {sys._getframe().f_code.co_name},\nWith: {locals().get("file", "Unknown file")}.')
       quit()
+
+  def ReportLoad(self, start):
+    # Report the time spent waiting on reads separately from the time spent handling the loaded data
+    loadtime = time.time() - start
+    print(f'Time to load : {loadtime:.4f}s (I/O wait: {self.iowait:.4f}s, compute: {loadtime - self.iowait:.4f}s, prefetch depth: {o.prefetch})')
+
+  def Prefetch(self, function, items):
+    # Apply function to the items in background threads, with at most o.prefetch results read ahead of the consumer
+    # Results are yielded in order, the time spent waiting on them is added to the I/O wait
+    if not o.prefetch:
+      # Without prefetching every item is read when it is needed
+      for item in items:
+        start = time.time()
+        result = function(item)
+        self.iowait += time.time() - start
+        yield result
+      return
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=o.prefetch) as executor:
+      # Bounded queue of pending reads, refilled by one item for every result consumed
+      queue = deque(executor.submit(function, item) for item in islice(items, o.prefetch))
+      while queue:
+        start = time.time()
+        result = queue.popleft().result()
+        self.iowait += time.time() - start
+        queue.extend(executor.submit(function, item) for item in islice(items, 1))
+        yield result
+            
+  def Stream(self, files):
+    # Read the files one after another, the read-ahead continues across the chunks taken from the stream
+    return self.Prefetch(self.LoadFitsData, files)
+
+  def LoadChunk(self, files, stream=None):
+    # Load a chunk of files into (channels, files) arrays, used when the data does not fit in memory
+    # With a stream of every file the next files are read while this chunk is handled, otherwise only the chunk is read
+    loaded = islice(stream, len(files)) if stream is not None else self.Stream(files)
+    frequency, channels, rhcp, lhcp = zip(*loaded)
+    # Count the loaded files like HandleLoadData does
+    self.count += len(files)
+    return np.array(frequency).T, np.array(rhcp).T, np.array(lhcp).T
             
   def LoadFitsData(self, file):
     # Load data
     try:
-      # Open the FITS file
-      with fits.open(file) as hdu:
-        # Load data from the second HDU (hdu[1])
-        data = Table(hdu[1].data)
-      # Extract and process the 'frequency' column from the data
-      frequency = data['frequency'] / 1e6 # Convert from Hz to MHz
-      # Create an array of channel indicies based on the length of the frequency data
-      channels = np.arange(len(data['frequency']))
-      # Extract 'RHCPAVG' and 'LHCPAVG' data columns
-      rhcp = data['rhcpavg']
-      lhcp = data['lhcpavg']
+      # Open the FITS file memory mapped so only the selected rows are read and decoded
+      with fits.open(file, memmap=True) as hdu:
+        # Slice the rows of the second HDU (hdu[1]) before any column is accessed
+        data = hdu[1].data[self.ch0:self.ch1]
+        # Extract and process the 'frequency' column from the data
+        frequency = self.LoadColumn(data, 'frequency') / 1e6 # Convert from Hz to MHz
+        # Extract 'RHCPAVG' and 'LHCPAVG' data columns
+        rhcp = self.LoadColumn(data, 'rhcpavg')
+        lhcp = self.LoadColumn(data, 'lhcpavg')
+      # Create an array of channel indicies matching the selected rows
+      channels = np.arange(self.ch0, self.ch0 + len(frequency))
       # Return the extracted data
       return frequency, channels, rhcp, lhcp
     except (Exception) as e:
@@ -191,15 +263,21 @@ class FITSHandler:
       print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {file}.')
       quit()
           
-  def LoadMetaData(self, file):
+  def LoadColumn(self, data, name):
+    # Copy a column of the selected rows into native byte order, so the memory map can be closed
+    column = data.field(name)
+    return np.array(column, dtype=column.dtype.newbyteorder('='))
+          
+  @staticmethod
+  def LoadMetaData(file):
     # Load metadata
     time_differences = [] # List to store time differences between observation start and end times
     metadata = {}  # Dictionary to store extracted metadata
     try:
       # Open the FITS file
-      with fits.open(file) as hdu:
-        # Load metadata from the first HDU (hdu[0])
-        header = hdu[0].header
+      with open(file, 'rb') as fitsfile:
+        # Load metadata from the primary header only, the data tables are not opened
+        header = fits.Header.fromfile(fitsfile)
         # Populate the metadata dictionary with values from the header
         metadata['file'] = file  # Path to the FITS file
         metadata['SAMPRATE'] = header['SAMPRATE']  # Sample rate
@@ -252,6 +330,420 @@ class FITSHandler:
     print('Debugged FITSHandler, qutting program')
     quit()
 
+class DirectoryScanner:
+  # Discovers the files of a directory tree with os.scandir, scanning the subdirectories concurrently in threads
+  # FITS files are kept when their name or relative path matches an include pattern and no exclude pattern,
+  # directories matching an exclude pattern are not descended into
+  def __init__(self, directory, include=None, exclude=None, depth=None, threads=1):
+    self.directory = directory
+    self.include = self.Patterns(include) or ['*']
+    self.exclude = self.Patterns(exclude)
+    # Deepest subdirectory level scanned, 0 scans only the given directory, None scans the whole tree
+    self.depth = depth
+    self.threads = max(1, threads or 1)
+    # Counters of the last scan
+    self.skipped = 0 # Files not matching the patterns
+    self.unreadable = 0 # Directories that could not be listed
+    self.directories = 0 # Directories scanned
+    self.time = 0 # Time spent on the scan
+
+  @staticmethod
+  def Patterns(patterns):
+    # Split comma separated glob patterns into a list
+    return [pattern.strip() for pattern in (patterns or '').split(',') if pattern.strip()]
+
+  def Matches(self, patterns, entry):
+    # Match a directory entry by its name or by its path relative to the scanned directory
+    path = os.path.relpath(entry.path, self.directory)
+    return any(fnmatch.fnmatch(entry.name, pattern) or fnmatch.fnmatch(path, pattern) for pattern in patterns)
+
+  def ScanDirectory(self, path, level):
+    # List a single directory, returning its matching files, the subdirectories to scan next and the skipped count
+    files, subdirectories, skipped = [], [], 0
+    try:
+      with os.scandir(path) as entries:
+        for entry in entries:
+          # Subdirectories are not followed through symbolic links, like os.walk
+          if entry.is_dir(follow_symlinks=False):
+            if (self.depth is None or level < self.depth) and not self.Matches(self.exclude, entry):
+              subdirectories.append((entry.path, level + 1))
+          # Only FITS files are kept, whatever the patterns, so sidecar files are never read as headers
+          elif entry.name.endswith('.fits') and self.Matches(self.include, entry) and not self.Matches(self.exclude, entry):
+            files.append(entry.path)
+          else:
+            skipped += 1
+    except OSError:
+      # Unreadable directories are counted and ignored, like os.walk
+      return files, subdirectories, skipped, False
+    return files, subdirectories, skipped, True
+
+  def Collect(self, result, files):
+    # Add the result of one directory to the files and counters, returning its subdirectories
+    found, subdirectories, skipped, readable = result
+    files.extend(found)
+    self.skipped += skipped
+    self.directories += readable
+    self.unreadable += not readable
+    return subdirectories
+
+  def Scan(self):
+    # Scan the directory tree and return the sorted paths of the matching files
+    start = time.time()
+    self.skipped = self.unreadable = self.directories = 0
+    files = []
+    if self.threads == 1:
+      # Scan the directories one after another
+      queue = deque([(self.directory, 0)])
+      while queue:
+        queue.extend(self.Collect(self.ScanDirectory(*queue.popleft()), files))
+    else:
+      # Submit every subdirectory as soon as its parent is listed, so deep and wide trees keep all threads busy
+      with ThreadPoolExecutor(max_workers=self.threads) as executor:
+        pending = {executor.submit(self.ScanDirectory, self.directory, 0)}
+        while pending:
+          done, pending = wait(pending, return_when=FIRST_COMPLETED)
+          for future in done:
+            pending.update(executor.submit(self.ScanDirectory, *subdirectory) for subdirectory in self.Collect(future.result(), files))
+    # Sort the files, so the order does not depend on the listing order or on the threads
+    files.sort()
+    self.time = time.time() - start
+    return files
+
+class MetadataTable:
+  # Columnar metadata of the FITS files, stored as a NumPy structured array with one row per file
+  def __init__(self, records=None, columns=None):
+    # Build the columns from a list of per file metadata dictionaries, or use given columns
+    if columns is None:
+      names = list(records[0])
+      arrays = [np.array([record[name] for record in records]) for name in names]
+      # Observation times are stored as datetime64 so they can be compared and sorted vectorized
+      arrays = [array.astype('datetime64[s]') if array.dtype == object and isinstance(array[0], datetime) else array for array in arrays]
+      columns = np.empty(len(records), dtype=[(name, array.dtype) for name, array in zip(names, arrays)])
+      for name, array in zip(names, arrays):
+        columns[name] = array
+    self.columns = columns
+
+  def __len__(self):
+    return len(self.columns)
+
+  def __iter__(self):
+    # Iterate over the file indices, like the keys of a dictionary
+    return iter(range(len(self.columns)))
+
+  def __getitem__(self, idx):
+    # Metadata of a single file as a dictionary of Python values, times as datetime
+    row = self.columns[idx]
+    return {name: row[name].item() for name in self.columns.dtype.names}
+
+  def items(self):
+    # Iterate over the file indices and their metadata
+    return ((idx, self[idx]) for idx in self)
+
+  def Select(self, indices):
+    # New table with the rows given by a boolean mask or an array of indices
+    return MetadataTable(columns=self.columns[indices])
+
+  @classmethod
+  def Concatenate(cls, tables):
+    # New table with the rows of every table, text columns are widened to the longest value
+    arrays = {name: np.concatenate([table.columns[name] for table in tables]) for name in tables[0].columns.dtype.names}
+    columns = np.empty(sum(len(table) for table in tables), dtype=[(name, array.dtype) for name, array in arrays.items()])
+    for name, array in arrays.items():
+      columns[name] = array
+    return cls(columns=columns)
+
+class CalibratedStore:
+  # Directory of calibrated (channels, files) arrays saved as .npy files with a manifest, opened as read-only memmaps
+  # An opened store stands in for FITSHandler, providing the metadata, files and counts of the stored files
+  version = 1
+  def __init__(self, directory):
+    try:
+      self.directory = directory
+      self.process = time.time()
+      # Read the manifest describing the arrays and the calibration parameters
+      with open(os.path.join(self.directory, 'manifest.json')) as manifest:
+        self.manifest = json.load(manifest)
+      if self.manifest.get('version') != self.version:
+        raise ValueError(f'Unsupported store version: {self.manifest.get("version")}')
+      # Map every array without reading it, slices of the arrays are read on access
+      self.arrays = {name: np.load(os.path.join(self.directory, f'{name}.npy'), mmap_mode='r') for name in self.manifest['arrays']}
+      self.metadata = MetadataTable(columns=np.load(os.path.join(self.directory, 'metadata.npy')))
+      self.files = list(self.metadata.columns['file'])
+      self.filecount = self.count = len(self.files)
+      self.ch0, self.ch1 = map(int, self.manifest['channels'].split(':'))
+    except (FileNotFoundError, ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {directory}.')
+      quit()
+
+  def __getitem__(self, name):
+    return self.arrays[name]
+
+  @classmethod
+  def Save(cls, directory, fitsdata, arrays, **parameters):
+    # Write the (channels, files) arrays, the metadata of the files and the manifest to the directory
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+      # Fortran order keeps every file (column) contiguous, like the loaded data
+      stored = np.lib.format.open_memmap(os.path.join(directory, f'{name}.npy'), mode='w+', dtype=array.dtype, shape=array.shape, fortran_order=True)
+      stored[...] = array
+      stored.flush()
+      del stored
+    np.save(os.path.join(directory, 'metadata.npy'), fitsdata.metadata.columns)
+    # The manifest is written last, a store without it is incomplete
+    manifest = {
+      'version': cls.version,
+      'created': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+      'files': len(fitsdata.files),
+      'arrays': {name: {'dtype': array.dtype.str, 'shape': list(array.shape)} for name, array in arrays.items()},
+      **parameters
+    }
+    with open(os.path.join(directory, 'manifest.json'), 'w') as file:
+      json.dump(manifest, file, indent=2)
+
+class RollupStore:
+  # Directory of partial regrids (sums and counts on fixed grids) of every observing night and month, saved by SavePartial
+  # The manifest records the calibration parameters and the files of every rollup, a rollup whose files changed is rebuilt
+  # The headers of the files are kept in an index, so a query only reads the headers of files added since
+  version = 1
+  def __init__(self, directory, **parameters):
+    try:
+      self.directory = directory
+      os.makedirs(self.directory, exist_ok=True)
+      self.manifest = {'version': self.version, 'parameters': parameters, 'rollups': {}}
+      self.headers, self.indexed = None, False
+      path = os.path.join(self.directory, 'manifest.json')
+      if os.path.exists(path):
+        with open(path) as manifest:
+          manifest = json.load(manifest)
+        # The headers do not depend on the parameters, only on the version of the store
+        if manifest.get('version') == self.version and os.path.exists(self.Path('headers', '.npy')):
+          self.headers = MetadataTable(columns=np.load(self.Path('headers', '.npy')))
+        # Rollups made with other parameters can not be merged, they are rebuilt as they are needed
+        if manifest.get('version') == self.version and manifest.get('parameters') == parameters:
+          self.manifest = manifest
+        else:
+          print(f'Warning: The rollups in {self.directory} were made with other parameters, they are rebuilt')
+    except (ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {directory}.')
+      quit()
+
+  def Path(self, key, extension='.npz'):
+    # Path of the partial regrid of a rollup
+    return os.path.join(self.directory, f'{key}{extension}')
+
+  def Lookup(self, files):
+    # Metadata of the files found in the header index, in the order of the files, and a mask of the files found
+    if self.headers is None:
+      return None, np.zeros(len(files), dtype=bool)
+    names = self.headers.columns['file']
+    known = np.isin(files, names)
+    sorter = np.argsort(names)
+    positions = sorter[np.searchsorted(names, np.array(files)[known], sorter=sorter)]
+    return self.headers.Select(positions), known
+
+  def Update(self, metadata):
+    # Add the headers of newly read files to the index, it is written with the manifest
+    self.headers = metadata if self.headers is None else MetadataTable.Concatenate([self.headers, metadata])
+    self.indexed = True
+
+  def Valid(self, key, files):
+    # True when the rollup exists and was made from exactly these files
+    return self.manifest['rollups'].get(key) == list(files) and os.path.exists(self.Path(key))
+
+  def Record(self, key, files):
+    # Record the files of a rollup saved to its path
+    self.manifest['rollups'][key] = list(files)
+
+  def Save(self):
+    # Write the header index and the manifest, replacing the previous ones only when they are complete
+    if self.indexed:
+      with open(self.Path('headers', '.npy.tmp'), 'wb') as file:
+        np.save(file, self.headers.columns)
+      os.replace(self.Path('headers', '.npy.tmp'), self.Path('headers', '.npy'))
+      self.indexed = False
+    path = os.path.join(self.directory, 'manifest.json')
+    with open(f'{path}.tmp', 'w') as file:
+      json.dump(self.manifest, file, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+class SavedProduct:
+  # Regridded product saved by FITSSaver, with its tables opened as memory maps
+  # An opened product stands in for RegridCalibration when plotting, providing the grids, averages, sums and counts
+  def __init__(self, hdul, filename, line=None):
+    self.hdul = hdul
+    self.filename = filename
+    self.label = os.path.splitext(os.path.basename(filename))[0]
+    self.header = hdul[0].header
+    # Suffixes of the columns of products saved with -p A
+    self.products = self.header['POLPROD'].split(',') if 'POLPROD' in self.header else None
+    if line is None:
+      velocity, frequency, power = hdul['VELOCITY'].data, hdul['FREQUENCY'].data, 'AVG_POWER'
+    else:
+      # A line of a multi-line product holds both grids in one table, with its own processing parameters
+      velocity = frequency = hdul[line].data
+      power = 'AVG_POWER_FR'
+      self.label = f'{self.label} {line}'
+      self.header = self.header.copy()
+      for key in ('CHRANGE', 'RESTFREQ', 'NUMBINS'):
+        if key in hdul[line].header:
+          self.header[key] = hdul[line].header[key]
+    self.velo_fr = velocity['VELOCITY']
+    self.average_vr = self.Column(velocity, 'AVG_POWER')
+    self.count_vr = velocity['NUM_MEAS']
+    self.sum_vr = self.Column(velocity, 'SUM_POWER_AVG')
+    self.freq_fr = frequency['FREQUENCY']
+    self.average_fr = self.Column(frequency, power)
+    # Dynamic spectrum and its epochs, when saved with --dyn
+    self.dynamic, self.epochs = None, None
+    if line is None and 'DYNAMIC' in hdul and 'EPOCHS' in hdul:
+      self.dynamic = hdul['DYNAMIC'].data
+      self.epochs = np.array(hdul['EPOCHS'].data['EPOCH'], dtype='datetime64[s]')
+
+  @classmethod
+  def Open(cls, filename):
+    # Open a saved file as a list of products, one for every line of a multi-line product
+    try:
+      hdul = fits.open(filename, memmap=True)
+      lines = [hdu.name for hdu in hdul[1:] if hdu.name.startswith('LINE')]
+      if 'VELOCITY' in hdul and 'FREQUENCY' in hdul:
+        return [cls(hdul, filename)]
+      if lines:
+        return [cls(hdul, filename, line) for line in lines]
+      raise ValueError(f'{filename} has no VELOCITY and FREQUENCY tables or LINE tables')
+    except (FileNotFoundError, ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {filename}.')
+      quit()
+
+  def Column(self, table, name):
+    # A column of the table, or a row per polarization product for products saved with -p A
+    if self.products is None:
+      return table[name]
+    return np.array([table[f'{name}_{product}'] for product in self.products])
+
+class CubeStreamer:
+  # Writes the (epochs, bins) regridded spectra to a FITS image row by row while blocks of files are calibrated
+  # Only the rows of the current block are held in memory, the file is finalized with an EPOCHS table by Close
+  def __init__(self, filename, fitsdata, regrid):
+    try:
+      self.filename = filename
+      self.regrid = regrid
+      self.saver = FITSSaver(fitsdata)
+      # Time buckets of the files, the rows are written in order so the files have to be in time order
+      self.epochs, self.buckets = self.regrid.Buckets(fitsdata.metadata)
+      if np.any(np.diff(self.buckets) < 0):
+        raise ValueError('Files are not in time order, the cube rows can not be streamed')
+      # The image size is known before any data, so the header is written first
+      header = fits.Header()
+      header['SIMPLE'] = True
+      header['BITPIX'] = -32
+      header['NAXIS'] = 2
+      header['NAXIS1'] = self.regrid.num_velo
+      header['NAXIS2'] = len(self.epochs)
+      header['EXTEND'] = True
+      header.extend(self.saver.BuildPrimaryHDU(bins=self.regrid.num_velo).header, strip=True)
+      self.saver.DynamicHeader(header, self.regrid)
+      # An existing file is replaced, like the -o output
+      if os.path.exists(self.filename):
+        os.remove(self.filename)
+      self.stream = fits.StreamingHDU(self.filename, header)
+      # Row still accumulating files: its bucket, sums and counts
+      self.pending = None
+      self.counts = np.zeros(len(self.epochs), dtype=self.regrid.count_type)
+    except (ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {filename}.')
+      quit()
+
+  def Write(self, x_v, y, columns):
+    # Accumulate a block of files, every row before the bucket of the last file in the block is complete and written
+    first, sums, counts = self.regrid.EpochRows(x_v, y, self.buckets[columns], self.regrid.FileWeights(columns))
+    if self.pending is not None:
+      if self.pending[0] == first:
+        sums[:1] += self.pending[1]
+        counts[:1] += self.pending[2]
+      else:
+        self.WriteRows(*self.pending)
+    self.WriteRows(first, sums[:-1], counts[:-1])
+    self.pending = (first + len(sums) - 1, sums[-1:], counts[-1:])
+
+  def WriteRows(self, first, sums, counts):
+    # Average the rows and append them to the image
+    if len(sums):
+      with np.errstate(divide='ignore', invalid='ignore'):
+        self.stream.write(np.divide(sums, counts).astype(np.float32))
+      self.counts[first:first + len(counts)] = counts.sum(axis=1)
+
+  def Close(self):
+    # Write the last row, then append the EPOCHS table to the finished image
+    if self.pending is not None:
+      self.WriteRows(*self.pending)
+      self.pending = None
+    self.stream.close()
+    with fits.open(self.filename, mode='append') as hdul:
+      hdul.append(self.saver.BuildEpochsHDU(self.epochs, self.counts))
+    print(f'Cube saved as: {self.filename}')
+
+class SharedCube:
+  # (channels, files) arrays in shared memory segments, worker processes attach to them by name without copying
+  def __init__(self):
+    self.segments = {}
+    self.arrays = {}
+    self.owner = True
+    # The segments are removed at exit, also after an error, quit() or SIGTERM
+    # If the process is killed the multiprocessing resource tracker removes the segments it leaves behind
+    atexit.register(self.Release)
+    signal.signal(signal.SIGTERM, self.Terminate)
+
+  def Create(self, name, shape, dtype, data=None):
+    # Allocate a Fortran ordered array in a new segment, so blocks of files (columns) are contiguous like the loaded data
+    dtype = np.dtype(dtype)
+    self.segments[name] = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self.segments[name].buf, order='F')
+    if data is not None:
+      self.arrays[name][...] = data
+    return self.arrays[name]
+
+  def __getitem__(self, name):
+    return self.arrays[name]
+
+  def __getstate__(self):
+    # Only the segment names, shapes and types are pickled for the workers
+    return {name: (self.segments[name].name, array.shape, array.dtype.str) for name, array in self.arrays.items()}
+
+  def __setstate__(self, state):
+    # Attach to the segments of the owner, an attached cube never removes them
+    self.segments, self.arrays, self.owner = {}, {}, False
+    for name, (segment, shape, dtype) in state.items():
+      self.segments[name] = shared_memory.SharedMemory(name=segment)
+      self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=self.segments[name].buf, order='F')
+
+  def Close(self):
+    # Unmap the segments from this process, a segment still used by an array is unmapped at exit instead
+    self.arrays = {}
+    for segment in self.segments.values():
+      try:
+        segment.close()
+      except BufferError:
+        pass
+
+  def Release(self):
+    # Remove the segments, the names are unlinked first so nothing is left behind even if arrays are still in use
+    if self.owner:
+      for segment in self.segments.values():
+        try:
+          segment.unlink()
+        except FileNotFoundError:
+          pass
+    self.Close()
+    self.segments = {}
+
+  def Terminate(self, signum, frame):
+    # Exit normally on SIGTERM so the segments are released by the exit handler
+    sys.exit(128 + signum)
+
 class FITSSaver:
   # FITSSaver Constructor
   def __init__(self, fitsdata):
@@ -259,54 +751,14 @@ class FITSSaver:
       self.filename = os.path.basename(self.fitsdata.files[0])  # Extract the base filename from the first file  
   def SaveToFitsFile(self, regrid):
     try:
-      # Determine the index of the last metadata entry
-      finalvalue = len(list(self.fitsdata.metadata)) - 1
-      # Create a new FITS Primary HDU (Header/Data Unit)
-      pHDU = fits.PrimaryHDU()
-      ph = pHDU.header  # Access the header of the primary HDU
-      # Software Related Metadata
-      ph['SW-VERS'] = (globals.PROGRAM_VERSION, "File created by software version")
-      ph['SW-NAME'] = (globals.PROGRAM_NAME, "File created by software name")
-      ph['DATE'] = (globals.CURRENT_DATE_TIME.strftime('%Y-%m-%dT%H:%M:%S'), "File creation date")
-      # Observation Related Metadata
-      ph['ORIGIN'] = (globals.ORIGIN_NAME, "Metsahovi Radio Observatory")
-      ph['TELESCOP'] = (self.fitsdata.metadata[0]['TELESCOP'], "Telescope")
-      ph['RA'] = (self.fitsdata.metadata[0]['RA'], "Right Ascension pointing (deg)")
-      ph['DEC'] = (self.fitsdata.metadata[0]['DEC'], "Declination pointing (deg)")
-      ph['EQUINOX'] = ("2000.0", "Equinox")
-      ph['AVGINTEG'] = (self.fitsdata.metadata[0]['AVG-OBS'], "Average observation integration time")
-      ph['OBJECT'] = (self.fitsdata.metadata[0]['OBJECT'], "Object")
-      # Date Related Metadata
-      ph['DATE-OBS'] = (self.fitsdata.metadata[0]['DATE-OBS'].strftime('%Y-%m-%dT%H:%M:%S'), "Observation start")
-      ph['DATE-END'] = (self.fitsdata.metadata[int(finalvalue)]['DATE-END'].strftime('%Y-%m-%dT%H:%M:%S'), "Observation end")
-      # Processing Related Metadata
-      ph['SAMPRATE'] = (self.fitsdata.metadata[0]['SAMPRATE'], "Sample rate Hz")
-      ph['NUMINPUT'] = (self.fitsdata.count, "Number of raw input files")
-      ph['CHRANGE'] = (o.channels, "Range of channels to include in data processing")
-      ph['POL'] = (o.polarization, "Polarization: R=Right, L=Left, B=Right+Left")
-      ph['RESTFREQ'] = (o.rfreq, "Rest frequency [MHz]")
-      ph['NUMBINS'] = (o.bins, "Number of re-grid bins")
-      # Reference Related Metadata
-      ph['TIMESYS'] = ("UTC", "Temporal Reference Frame")
-      ph['REFFRAME'] = ('LSRK', "Reference Frame")
-      # Define columns for velocity data
-      velo_c1 = fits.Column(name='VELOCITY', format='E', array=regrid.velo_fr, unit='km/s')
-      velo_c2 = fits.Column(name='AVG_POWER', format='E', array=regrid.average_vr, unit='ADU')
-      velo_c3 = fits.Column(name='NUM_MEAS', format='E', array=regrid.count_vr)
-      velo_c4 = fits.Column(name='SUM_POWER_AVG', format='E', array=regrid.sum_vr)
-      # Define columns for frequency data
-      freq_c1 = fits.Column(name='FREQUENCY', format='E', array=regrid.freq_fr, unit='MHz')
-      freq_c2 = fits.Column(name='AVG_POWER', format='E', array=regrid.average_fr, unit='ADU')
+      # Build the HDUList holding the regridded data
+      self.hdu = self.BuildHDUList(regrid)
       # Generate a filename with a timestamp and program stamp
       timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
       programstamp = 'calibrated'
       filename = f'{self.fitsdata.metadata[0]["OBJECT"]}_{timestamp}_{programstamp}.fits'
-      # Create HDUs (Header/Data Units) for the velocity and frequency data
-      self.velo_data = fits.BinTableHDU.from_columns([velo_c1, velo_c2, velo_c3, velo_c4], name='VELOCITY')
-      self.freq_data = fits.BinTableHDU.from_columns([freq_c1, freq_c2], name='FREQUENCY')
-      self.hdu = fits.HDUList([pHDU, self.velo_data, self.freq_data])
       # Output results
-      print(f'Directory processed: {o.directory}')
+      print(f'Directory processed: {self.fitsdata.directory}')
       if o.output:
         self.hdu.writeto(f'{o.output}', overwrite=True) # Write to specified output file, overwrite if it exists
         print(f'Result saved as: {o.output}')     
@@ -322,6 +774,140 @@ class FITSSaver:
     except (ValueError, IndexError, Exception) as e: 
       # Handle errors
       print(f'Error : {e},\nOccurred in : {sys._getframe().f_code.co_name},\nWith : {regrid}.') 
+  def SaveProduct(self, regrid, filename, channels=None, rfreq=None, bins=None):
+    # Save a single product with its own processing parameters, without exiting the program
+    try:
+      hdu = self.BuildHDUList(regrid, channels, rfreq, bins)
+      hdu.writeto(filename, overwrite=True)
+      hdu.close()
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccurred in : {sys._getframe().f_code.co_name},\nWith : {filename}.')
+  def BuildHDUList(self, regrid, channels=None, rfreq=None, bins=None):
+    # Create the primary HDU holding the observation and processing metadata
+    pHDU = self.BuildPrimaryHDU(channels, rfreq, bins or regrid.num_velo)
+    # Define columns for velocity data
+    velo_c1 = fits.Column(name='VELOCITY', format='E', array=regrid.velo_fr, unit='km/s')
+    velo_c2 = self.ProductColumns('AVG_POWER', regrid.average_vr, unit='ADU')
+    velo_c3 = fits.Column(name='NUM_MEAS', format='E', array=regrid.count_vr)
+    velo_c4 = self.ProductColumns('SUM_POWER_AVG', regrid.sum_vr)
+    # Define columns for frequency data
+    freq_c1 = fits.Column(name='FREQUENCY', format='E', array=regrid.freq_fr, unit='MHz')
+    freq_c2 = self.ProductColumns('AVG_POWER', regrid.average_fr, unit='ADU')
+    # Create HDUs (Header/Data Units) for the velocity and frequency data
+    self.velo_data = fits.BinTableHDU.from_columns([velo_c1, *velo_c2, velo_c3, *velo_c4], name='VELOCITY')
+    self.freq_data = fits.BinTableHDU.from_columns([freq_c1, *freq_c2], name='FREQUENCY')
+    hdus = [pHDU, self.velo_data, self.freq_data]
+    # Add the dynamic spectrum and its epochs if it was calculated
+    if regrid.dynamic is not None:
+      hdus.extend(self.BuildDynamicHDUs(regrid))
+    return fits.HDUList(hdus)
+  def ProductColumns(self, name, array, unit=None):
+    # One column for a single polarization product, or a column per product (AVG_POWER_R, AVG_POWER_L, ...) for all products
+    if np.ndim(array) == 1:
+      return [fits.Column(name=name, format='E', array=array, unit=unit)]
+    return [fits.Column(name=f'{name}_{product}', format='E', array=values, unit=unit) for product, values in zip(calibrations.PolarizationCalibration.products, array)]
+  def BuildDynamicHDUs(self, regrid):
+    # Create an image HDU of the (epochs, bins) dynamic spectrum and a table of its epochs
+    dynamic = fits.ImageHDU(data=regrid.dynamic.astype(np.float32), name='DYNAMIC')
+    self.DynamicHeader(dynamic.header, regrid)
+    return [dynamic, self.BuildEpochsHDU(regrid.epochs, regrid.dynamic_count.sum(axis=1))]
+  def DynamicHeader(self, dh, regrid):
+    # Describe the velocity and epoch axes of an (epochs, bins) image
+    velocity = np.asarray(getattr(regrid.velo_fr, 'value', regrid.velo_fr))
+    dh['BUNIT'] = ('ADU', "Average power")
+    dh['CTYPE1'] = ('VRAD', "Velocity axis")
+    dh['CUNIT1'] = ('km/s', "Velocity unit")
+    dh['CRPIX1'] = (1.0, "Reference bin")
+    dh['CRVAL1'] = (float(velocity[0]), "Velocity of the reference bin")
+    dh['CDELT1'] = (float(velocity[1] - velocity[0]) if len(velocity) > 1 else 0.0, "Velocity bin width")
+    dh['CTYPE2'] = ('EPOCH', "Row index into the EPOCHS table")
+    dh['BUCKET'] = (o.dynamic or 'file', "Time bucket of each row: file or night")
+  def BuildEpochsHDU(self, epochs, counts):
+    # Create a table of the epoch and measurement count of every row of an (epochs, bins) image
+    return fits.BinTableHDU.from_columns([
+      fits.Column(name='EPOCH', format='19A', array=np.datetime_as_string(epochs.astype('datetime64[s]'))),
+      fits.Column(name='NUM_MEAS', format='J' if np.issubdtype(counts.dtype, np.integer) else 'E', array=counts)
+    ], name='EPOCHS')
+  def BuildPrimaryHDU(self, channels=None, rfreq=None, bins=None):
+    # Determine the index of the last metadata entry
+    finalvalue = len(list(self.fitsdata.metadata)) - 1
+    # Create a new FITS Primary HDU (Header/Data Unit)
+    pHDU = fits.PrimaryHDU()
+    ph = pHDU.header  # Access the header of the primary HDU
+    # Software Related Metadata
+    ph['SW-VERS'] = (globals.PROGRAM_VERSION, "File created by software version")
+    ph['SW-NAME'] = (globals.PROGRAM_NAME, "File created by software name")
+    ph['DATE'] = (globals.CURRENT_DATE_TIME.strftime('%Y-%m-%dT%H:%M:%S'), "File creation date")
+    # Observation Related Metadata
+    ph['ORIGIN'] = (globals.ORIGIN_NAME, "Metsahovi Radio Observatory")
+    ph['TELESCOP'] = (self.fitsdata.metadata[0]['TELESCOP'], "Telescope")
+    ph['RA'] = (self.fitsdata.metadata[0]['RA'], "Right Ascension pointing (deg)")
+    ph['DEC'] = (self.fitsdata.metadata[0]['DEC'], "Declination pointing (deg)")
+    ph['EQUINOX'] = ("2000.0", "Equinox")
+    ph['AVGINTEG'] = (self.fitsdata.metadata[0]['AVG-OBS'], "Average observation integration time")
+    ph['OBJECT'] = (self.fitsdata.metadata[0]['OBJECT'], "Object")
+    # Date Related Metadata
+    ph['DATE-OBS'] = (self.fitsdata.metadata[0]['DATE-OBS'].strftime('%Y-%m-%dT%H:%M:%S'), "Observation start")
+    ph['DATE-END'] = (self.fitsdata.metadata[int(finalvalue)]['DATE-END'].strftime('%Y-%m-%dT%H:%M:%S'), "Observation end")
+    # Processing Related Metadata, parameters not given fall back to the options
+    ph['SAMPRATE'] = (self.fitsdata.metadata[0]['SAMPRATE'], "Sample rate Hz")
+    ph['NUMINPUT'] = (self.fitsdata.count, "Number of raw input files")
+    ph['CHRANGE'] = (channels or o.channels, "Range of channels to include in data processing")
+    ph['POL'] = (o.polarization, "Polarization: R=Right, L=Left, B=Right+Left")
+    if str(o.polarization).upper() == 'A':
+      ph['POLPROD'] = (','.join(calibrations.PolarizationCalibration.products), "Column suffixes: R, L, B=normalized R+L, D=R-L")
+    ph['RESTFREQ'] = (rfreq or o.rfreq, "Rest frequency [MHz]")
+    ph['NUMBINS'] = (bins or o.bins, "Number of re-grid bins")
+    # Weighting and excluded channels of the regrid
+    if o.weight:
+      ph['WEIGHT'] = (o.weight, "Per file weight, NUM_MEAS are sums of weights")
+    if o.mask:
+      ph['CHMASK'] = (o.mask, "Channel ranges excluded from the regrid")
+    # Fixed grids, products on the same grids can be summed bin for bin
+    if o.vgrid:
+      ph['VGRID'] = (o.vgrid, "Fixed velocity grid VMIN:VMAX:DV [km/s]")
+    if o.fgrid:
+      ph['FGRID'] = (o.fgrid, "Fixed frequency grid FMIN:FMAX:DF [MHz]")
+    # Reference Related Metadata
+    ph['TIMESYS'] = ("UTC", "Temporal Reference Frame")
+    ph['REFFRAME'] = ('LSRK', "Reference Frame")
+    return pHDU
+  def SaveLines(self, regrids, lines, filename):
+    # Save several spectral lines into one file, with one table HDU per line
+    try:
+      # The primary header lists the parameters of every line
+      pHDU = self.BuildPrimaryHDU(
+        ','.join(channels for channels, _, _ in lines),
+        ','.join(str(rfreq) for _, rfreq, _ in lines),
+        ','.join(str(regrid.num_velo) for regrid in regrids))
+      pHDU.header['NUMLINES'] = (len(lines), "Number of spectral lines")
+      hdus = [pHDU]
+      for idx, (regrid, (channels, rfreq, _)) in enumerate(zip(regrids, lines)):
+        # Velocity and frequency grids share the bin count, so both fit in a single table
+        columns = [
+          fits.Column(name='VELOCITY', format='E', array=regrid.velo_fr, unit='km/s'),
+          fits.Column(name='AVG_POWER', format='E', array=regrid.average_vr, unit='ADU'),
+          fits.Column(name='NUM_MEAS', format='E', array=regrid.count_vr),
+          fits.Column(name='SUM_POWER_AVG', format='E', array=regrid.sum_vr),
+          fits.Column(name='FREQUENCY', format='E', array=regrid.freq_fr, unit='MHz'),
+          fits.Column(name='AVG_POWER_FR', format='E', array=regrid.average_fr, unit='ADU')
+        ]
+        line = fits.BinTableHDU.from_columns(columns, name=f'LINE{idx + 1}')
+        line.header['CHRANGE'] = (channels, "Range of channels of the line")
+        line.header['RESTFREQ'] = (rfreq, "Rest frequency [MHz]")
+        line.header['NUMBINS'] = (regrid.num_velo, "Number of re-grid bins")
+        hdus.append(line)
+      self.hdu = fits.HDUList(hdus)
+      self.hdu.writeto(filename, overwrite=True)
+      print(f'Result saved as: {filename}')
+      # Print data for debugging/testing purposes
+      if o.printdata:
+        self.LoadFitsFile()
+      self.hdu.close()
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccurred in : {sys._getframe().f_code.co_name},\nWith : {filename}.')
   def LoadFitsFile(self):
       self.hdu.info()  # Print information about the HDUList
       table_data = Table(self.hdu[1].data)  # Convert the second HDU (velocity data) to a Table
@@ -9,6 +9,7 @@ ORIGIN_NAME='Metsahovi'
 PROGRAM_VERSION='1.0'
 PROGRAM_CREATION_DATE='2024-08-01'
 CURRENT_DATE_TIME=datetime.utcnow()
+KERNEL_BLOCK_SIZE=65536 # Elements per block processed by the in place numerical kernels
 MCA_TELESCOPE_VALUES={
   'MAINANT':{
       'latitude':60.21780915277778*u.deg,
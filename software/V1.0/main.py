@@ -1,28 +1,43 @@
 # Imports
+import os
+import csv
+import glob
 import sys
+import json
 import time
+import tempfile
+import globals
 import plotting
 import calibrations
 import controller
 import numpy as np
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from options import o
 
 # Main Module of the Spectral Calibration Software
 
+def PrintTable(rows):
+  # Print a list of row dictionaries as a fixed width table, floats with 4 decimals
+  print(' '.join(f'{key:>12}' for key in rows[0]))
+  for row in rows:
+    print(' '.join(f'{value:>12.4f}' if isinstance(value, float) else f'{str(value):>12}' for value in row.values()))
+
 class SpectralCalibrationSoftware:
   # SCS Class
   def __init__(self, directory):
     # Initialize the class with the directory where data is stored
     self.directory = directory
-    # Create an instance of FITSHandler to manage FITS files in the specified directory
-    self.fitsdata = controller.FITSHandler(self.directory) 
     # Initialize various calibration objects from the calibrations module
     # These objects will be used to perform different calibration tasks
     self.cut = calibrations.ChannelCalibration()
+    # Create an instance of FITSHandler to manage FITS files in the specified directory, reading only the channel range
+    self.fitsdata = controller.FITSHandler(self.directory, self.cut.channels) 
     self.pol = calibrations.PolarizationCalibration()
     self.median = calibrations.MedianCalibration()
     self.doppler = calibrations.VelocityCalibration(self.fitsdata)  # Pass FITSHandler instance for velocity calibration
     self.regrid = calibrations.RegridCalibration()
+    self.regrid.SetData(self.fitsdata.metadata, self.cut.ch0)
     # Call methods to perform initialization, processing, calibration, and utilization of data
     self.InitializeData()
     self.ProcessData()
@@ -48,10 +63,12 @@ class SpectralCalibrationSoftware:
         self.channels.append(self.fitsdata.channels[file]) # Channel data
       else:
         # After processing all files, convert lists to numpy arrays and slice them based on calibration
-        self.frequency = np.array(self.frequency).T[self.cut.ch0:self.cut.ch1] # Transpose and slice frequency data
-        self.channels = np.array(self.channels).T[self.cut.ch0:self.cut.ch1] # Transpose and slice channel data
-        self.rhcp = np.array(self.rhcp).T[self.cut.ch0:self.cut.ch1] # Transpose and slice RHCP data
-        self.lhcp = np.array(self.lhcp).T[self.cut.ch0:self.cut.ch1] # Transpose and slice LHCP data
+        # The loaded rows start at the first loaded channel, so the slice is relative to it
+        ch0, ch1 = self.cut.ch0 - self.fitsdata.ch0, self.cut.ch1 - self.fitsdata.ch0
+        self.frequency = np.array(self.frequency).T[ch0:ch1] # Transpose and slice frequency data
+        self.channels = np.array(self.channels).T[ch0:ch1] # Transpose and slice channel data
+        self.rhcp = np.array(self.rhcp).T[ch0:ch1] # Transpose and slice RHCP data
+        self.lhcp = np.array(self.lhcp).T[ch0:ch1] # Transpose and slice LHCP data
         # Calculate and print the time taken to process the data
         self.processend = time.time() # End time of processing
         self.processtime = self.processend - self.fitsdata.process # Calculate processing time
@@ -69,7 +86,9 @@ class SpectralCalibrationSoftware:
       self.pol.Polarization(self.rhcp, self.lhcp) # Apply polarization calibration
       # Check if median calibration should be applied
       if o.median:
-        self.median.Median(self.pol.ysignal) # Apply median calibration to the signal
+        # The median of every polarization product is taken separately
+        for ysignal in self.pol.Products():
+          self.median.Median(ysignal) # Apply median calibration to the signal
       else:
         print('Warning: Median calibration was not utilized') # Warning if median calibration is not used
       # Apply Doppler velocity calibration using frequency data
@@ -81,12 +100,51 @@ class SpectralCalibrationSoftware:
         self.pol.ysignal, # Polarized signal
         self.fitsdata.count # FITS data count
       )
+      # Calculate the dynamic spectrum on the same velocity grid if requested
+      if o.dynamic or o.dynamicplot:
+        self.regrid.DynamicSpectrum(
+          self.doppler.velocity, # Doppler-corrected velocity
+          self.pol.ysignal, # Polarized signal
+          self.fitsdata.metadata # Observation times of the files
+        )
+      # Stream the regridded spectrum of every epoch to a FITS image if requested
+      if o.cube:
+        self.StreamCube()
     except (ValueError, IndexError, Exception) as e:
       # Handle errors
       print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.ysignal}, {self.frequency}.')
 
+  def StreamCube(self):
+    # Write the cube in blocks of files, only the rows of one block are held in memory
+    streamer = controller.CubeStreamer(o.cube, self.fitsdata, self.regrid)
+    channels, files = self.pol.ysignal.shape
+    step = max(1, globals.KERNEL_BLOCK_SIZE // channels)
+    for start in range(0, files, step):
+      block = slice(start, min(start + step, files))
+      streamer.Write(self.doppler.velocity[:, block], self.pol.ysignal[:, block], block)
+    streamer.Close()
+
+  def SaveStore(self):
+    # Save the calibrated signal, frequency and velocity of every file for later analyses
+    if self.pol.ysignal is None:
+      print('Warning: The calibrated arrays stay in the shard workers, no store was saved')
+      return
+    controller.CalibratedStore.Save(o.store, self.fitsdata, {
+        'ysignal': self.pol.ysignal, # Polarized signal
+        'frequency': self.frequency, # Frequency data
+        'velocity': np.asarray(getattr(self.doppler.velocity, 'value', self.doppler.velocity)) # Doppler-corrected velocity
+      },
+      channels=f'{self.cut.ch0}:{self.cut.ch1}',
+      polarization=self.pol.polarization,
+      median=o.median,
+      rfreq=o.rfreq)
+    print(f'Store saved as: {o.store}')
+
   def UtilizeData(self):
     try:
+      # Save the calibrated arrays if a store is requested
+      if o.store:
+        self.SaveStore()
       # Record the end time of the utilization process
       end = time.time()
       # Check if data should be saved or output
@@ -99,7 +157,7 @@ class SpectralCalibrationSoftware:
         print(f"Time to save: {end - start:.4f}s")
       elif o.testrun:
         # If a test run is specified, print a message indicating successful processing
-        print(f"Directory: {o.directory} was processed without errors")
+        print(f"Directory: {self.fitsdata.directory} was processed without errors")
         # Print the time taken for the test run
         print(f"Time to test: {end - start:.4f}s")
         # Stop the program after test run
@@ -121,14 +179,801 @@ class SpectralCalibrationSoftware:
       print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : Utilization of software')
       quit()
 
+class InteractiveCalibrationSoftware(SpectralCalibrationSoftware):
+  # Interactive Class, keeps the loaded data and its velocity resident for the explorer
+  def CalibrateData(self):
+    try:
+      # Velocity of every loaded channel is calculated once, the explorer re-runs the other calibrations on every change
+      self.doppler.Velocity(self.frequency)
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.frequency}.')
+
+  def UtilizeData(self):
+    try:
+      # Open the explorer on the uncalibrated signals
+      plotting.ExplorerUI(
+        self.fitsdata, # FITS data object
+        self.doppler, # Doppler-corrected velocity
+        self.frequency, # Frequency data
+        self.channels, # Channel data
+        self.rhcp, # RHCP data
+        self.lhcp # LHCP data
+      )
+    except (Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : Utilization of software')
+      quit()
+
+class ChunkedCalibrationSoftware(SpectralCalibrationSoftware):
+  # Out-of-core Class, processes the files in chunks fitting the memory budget using scratch files on disk
+  def __init__(self, directory):
+    # Initialize the class with the directory where data is stored
+    self.directory = directory
+    self.cut = calibrations.ChannelCalibration()
+    # Only the metadata is loaded here, the data is loaded chunk by chunk
+    self.fitsdata = controller.FITSHandler(self.directory, self.cut.channels, load=False)
+    self.pol = calibrations.PolarizationCalibration()
+    self.median = calibrations.MedianCalibration()
+    self.doppler = calibrations.VelocityCalibration(self.fitsdata)
+    self.regrid = calibrations.RegridCalibration()
+    self.regrid.SetData(self.fitsdata.metadata, self.cut.ch0)
+    # Memory budget in bytes and the scratch directory, removed when the program exits
+    self.budget = o.memory * 1024 ** 2
+    self.scratch = tempfile.TemporaryDirectory(prefix='scs_', dir=o.scratch)
+    self.ProcessData()
+    self.CalibrateData()
+    self.UtilizeData()
+
+  def Chunks(self, itemsize, length):
+    # Split length files (or channels) into slices where each slice fits the memory budget
+    size = max(1, int(self.budget // itemsize))
+    return [slice(idx, min(idx + size, length)) for idx in range(0, length, size)]
+
+  def Scratch(self, name, dtype, shape):
+    # Create a (channels, files) array on disk in the scratch directory
+    return np.lib.format.open_memmap(os.path.join(self.scratch.name, f'{name}.npy'), mode='w+', dtype=dtype, shape=shape)
+
+  def ProcessData(self):
+    try:
+      files = self.fitsdata.files
+      channels = self.cut.ch1 - self.cut.ch0
+      # Working memory per file is roughly 64 bytes per channel: frequency, signals, velocity, bin indices and temporaries
+      self.filechunks = self.Chunks(channels * 64, len(files))
+      print(f'Processing {len(files)} files in {len(self.filechunks)} chunks')
+      self.extremes = None
+      # One stream of every file, so the reads of the next chunk overlap the handling of the current one
+      start = time.time()
+      stream = self.fitsdata.Stream(files)
+      for chunk in self.filechunks:
+        # Load a chunk of files and copy it to the scratch arrays
+        frequency, rhcp, lhcp = self.fitsdata.LoadChunk(files[chunk], stream)
+        if chunk.start == 0:
+          shape = (frequency.shape[0], len(files))
+          self.frequency = self.Scratch('frequency', frequency.dtype, shape)
+          self.rhcp = self.Scratch('rhcp', rhcp.dtype, shape)
+          self.lhcp = self.Scratch('lhcp', lhcp.dtype, shape)
+        self.frequency[:, chunk], self.rhcp[:, chunk], self.lhcp[:, chunk] = frequency, rhcp, lhcp
+        # Merge the extremes used by the polarization normalization and the regrid grids
+        self.extremes = self.pol.MergeExtremes(self.extremes, rhcp, lhcp)
+        if not self.regrid.Fixed():
+          self.regrid.MinMaxRange(self.doppler.Doppler(frequency, columns=chunk), frequency)
+      self.fitsdata.ReportLoad(start)
+      # Channel numbers of every file, without copying
+      self.channels = np.broadcast_to(np.arange(self.cut.ch0, self.cut.ch0 + shape[0])[:, np.newaxis], shape)
+      # Calculate and print the time taken to process the data
+      self.processtime = time.time() - self.fitsdata.process
+      print(f"Time to process : {self.processtime:.4f}s")
+    except (FileNotFoundError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.fitsdata.files}.')
+      quit()
+
+  def CalibrateData(self):
+    try:
+      channels, files = self.frequency.shape
+      self.ysignal = None
+      # Form the polarized signal chunk by chunk, removing the mean of each file when the median is used
+      for chunk in self.filechunks:
+        # Same memory order as the transposed in-memory arrays, so the float32 reductions round identically
+        self.pol.Polarization(np.array(self.rhcp[:, chunk], order='F'), np.array(self.lhcp[:, chunk], order='F'), self.extremes)
+        if o.median:
+          self.median.Center(self.pol.ysignal)
+        if self.ysignal is None:
+          self.ysignal = self.Scratch('ysignal', self.pol.ysignal.dtype, (channels, files))
+        self.ysignal[:, chunk] = self.pol.ysignal
+      # The median of each channel needs every file, so it is calculated over blocks of channels
+      if o.median:
+        median = np.empty(channels, dtype=self.ysignal.dtype)
+        for block in self.Chunks(files * self.ysignal.itemsize * 4, channels):
+          median[block] = self.median.ChannelMedian(self.ysignal[block])
+      else:
+        print('Warning: Median calibration was not utilized') # Warning if median calibration is not used
+      # Velocity is only kept on disk when it is plotted or stored
+      plotted = not (o.savedata or o.output or o.testrun) or o.store
+      if plotted:
+        self.doppler.velocity = self.Scratch('velocity', np.float64, (channels, files))
+      if o.dynamic or o.dynamicplot:
+        self.regrid.Epochs(self.fitsdata.metadata)
+      # The cube rows are streamed while the chunks are calibrated
+      streamer = controller.CubeStreamer(o.cube, self.fitsdata, self.regrid) if o.cube else None
+      # Accumulate every chunk onto the grids found while loading
+      for chunk in self.filechunks:
+        ysignal = np.array(self.ysignal[:, chunk])
+        if o.median:
+          ysignal -= median[:, np.newaxis]
+          self.ysignal[:, chunk] = ysignal
+        frequency = np.array(self.frequency[:, chunk])
+        velocity = self.doppler.Doppler(frequency, columns=chunk)
+        self.regrid.Partial(velocity, frequency, ysignal, chunk)
+        if o.dynamic or o.dynamicplot:
+          self.regrid.DynamicPartial(velocity, ysignal, chunk)
+        if streamer:
+          streamer.Write(velocity, ysignal, chunk)
+        if plotted:
+          self.doppler.velocity[:, chunk] = velocity.value
+      if streamer:
+        streamer.Close()
+      # Calculate the averages from the merged sums and counts
+      self.regrid.Average()
+      self.pol.ysignal = self.ysignal
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.fitsdata.files}.')
+      quit()
+
+class ShardedCalibrationSoftware(SpectralCalibrationSoftware):
+  # Sharded Class, processes shards of the files in worker processes and merges their partial results
+  def __init__(self, directory):
+    # Initialize the class with the directory where data is stored
+    self.directory = directory
+    self.cut = calibrations.ChannelCalibration()
+    # Only the metadata is loaded here, every worker loads the files of its own shard
+    self.fitsdata = controller.FITSHandler(self.directory, self.cut.channels, load=False)
+    self.pol = calibrations.PolarizationCalibration()
+    self.doppler = calibrations.VelocityCalibration(self.fitsdata)
+    self.regrid = calibrations.RegridCalibration()
+    self.regrid.SetData(self.fitsdata.metadata, self.cut.ch0)
+    # Partition the filtered files into contiguous shards, at most one shard per file
+    self.shards = calibrations.KernelThreads.Blocks(len(self.fitsdata.files), o.shards)
+    # Shard files are written to the given directory, otherwise to a temporary one removed at exit
+    scratch = tempfile.TemporaryDirectory(prefix='scs_shards_') if not o.sharddir else None
+    self.sharddir = o.sharddir or scratch.name
+    os.makedirs(self.sharddir, exist_ok=True)
+    self.ProcessData()
+    self.CalibrateData()
+    self.UtilizeData()
+
+  def ShardPath(self, kind, shard):
+    # Path of the extent or partial file of a shard
+    return os.path.join(self.sharddir, f'{kind}_{shard:04d}.npz')
+
+  def ShardExtents(self, shard):
+    # Map step 1: load a shard and save the extremes needed for the shared grids and normalization
+    columns = self.shards[shard]
+    frequency, rhcp, lhcp = self.fitsdata.LoadChunk(self.fitsdata.files[columns])
+    # The LSRK corrections of the shard are calculated here and saved, so the partial step reuses them
+    velocity = self.doppler.Doppler(frequency, columns=columns)
+    np.savez(self.ShardPath('extent', shard),
+      version=1,
+      shard=shard,
+      extremes=np.array(self.pol.Extremes(rhcp, lhcp), dtype=np.float64),
+      frequency=np.array((np.min(frequency), np.max(frequency))),
+      velocity=np.array((np.min(velocity.value), np.max(velocity.value))),
+      corrections=self.doppler.corrections.value[columns])
+
+  def ShardPartial(self, shard):
+    # Map step 2: calibrate a shard and save its partial regrid on the shared grids
+    # The LSRK corrections come from the extent step, or are calculated here when it was skipped
+    columns = self.shards[shard]
+    frequency, rhcp, lhcp = self.fitsdata.LoadChunk(self.fitsdata.files[columns])
+    self.pol.Polarization(rhcp, lhcp, self.extremes)
+    velocity = self.doppler.Doppler(frequency, columns=columns)
+    self.regrid.Partial(velocity, frequency, self.pol.ysignal, columns)
+    if o.dynamic or o.dynamicplot:
+      self.regrid.DynamicPartial(velocity, self.pol.ysignal, columns)
+    self.regrid.SavePartial(self.ShardPath('partial', shard),
+      shard=shard,
+      count=columns.stop - columns.start,
+      files=np.array(self.fitsdata.files[columns]))
+
+  def ProcessData(self):
+    try:
+      # The median of every channel needs every file, so it can not be taken in the shards
+      if o.median:
+        raise ValueError('Shards can not be used with -m, the median depends on every file, use --mem or --shm instead')
+      print(f'Processing {len(self.fitsdata.files)} files in {len(self.shards)} shards with {o.workers} workers')
+      # The extents are only needed for grids derived from the data and for the normalization of both polarizations
+      self.extremes = None
+      if self.regrid.Fixed() and self.pol.polarization != 'B':
+        print('Fixed grids, the extent step is skipped')
+        extents = []
+      else:
+        extents = range(len(self.shards))
+        with ProcessPoolExecutor(max_workers=o.workers, initializer=calibrations.KernelThreads.Limit, initargs=(1,)) as executor:
+          list(executor.map(self.ShardExtents, extents))
+      # Reduce step 1: merge the extremes of every shard
+      for shard in extents:
+        with np.load(self.ShardPath('extent', shard)) as extent:
+          # Extremes are saved as (lmin, lmax, rmin, rmax) and merged like two tiny blocks of RHCP and LHCP data
+          extremes = extent['extremes']
+          self.extremes = self.pol.MergeExtremes(self.extremes, extremes[2:], extremes[:2])
+          self.regrid.MinMaxRange(extent['velocity'], extent['frequency'])
+          # The corrections of the shard are sent back to the workers of the partial step
+          self.doppler.StoreCorrections(self.shards[shard], extent['corrections'])
+      # Calculate and print the time taken to process the data
+      self.processtime = time.time() - self.fitsdata.process
+      print(f"Time to process : {self.processtime:.4f}s")
+    except (FileNotFoundError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.sharddir}.')
+      quit()
+
+  def CalibrateData(self):
+    try:
+      print('Warning: Median calibration was not utilized') # The median is refused with shards
+      if o.cube:
+        print('Warning: The calibrated arrays stay in the shard workers, no cube was saved')
+      if o.dynamic or o.dynamicplot:
+        self.regrid.Epochs(self.fitsdata.metadata)
+      with ProcessPoolExecutor(max_workers=o.workers, initializer=calibrations.KernelThreads.Limit, initargs=(1,)) as executor:
+        list(executor.map(self.ShardPartial, range(len(self.shards))))
+      # Reduce step 2: merge the partial regrids of every shard
+      self.fitsdata.count = 0
+      for shard in range(len(self.shards)):
+        self.fitsdata.count += int(self.regrid.MergePartial(self.ShardPath('partial', shard))['count'])
+      self.regrid.Average()
+      # Per file arrays stay in the workers, only the regridded products are available
+      self.frequency, self.channels, self.pol.ysignal = None, None, None
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.sharddir}.')
+      quit()
+
+class SharedCalibrationSoftware(SpectralCalibrationSoftware):
+  # Shared memory Class, runs the median, velocity and regrid stages in worker processes attached to the loaded data
+  def __init__(self, directory):
+    # The cube is created first so its segments are released even if loading fails
+    self.cube = controller.SharedCube()
+    super().__init__(directory)
+
+  @staticmethod
+  def Stage(cube, function, block, *args):
+    # Run a stage on a block in a worker, the cube is attached when it is unpickled and unmapped afterwards
+    try:
+      return function(cube, block, *args)
+    finally:
+      cube.Close()
+
+  @staticmethod
+  def CenterBlock(cube, block):
+    # Remove the mean of every file in a block of files
+    calibrations.MedianCalibration().Center(cube['ysignal'][:, block])
+
+  @staticmethod
+  def MedianBlock(cube, block):
+    # Remove the median of every channel in a block of channels
+    ysignal = cube['ysignal'][block]
+    ysignal -= calibrations.MedianCalibration().ChannelMedian(ysignal)[:, np.newaxis]
+
+  @staticmethod
+  def VelocityBlock(cube, block, doppler, rfreq):
+    # Calculate the LSRK corrections and the velocity of a block of files directly into the shared arrays
+    cube['corrections'][block] = doppler.Corrections(block).value[block]
+    doppler.Doppler(cube['frequency'][:, block], rfreq, columns=block, out=cube['velocity'][:, block])
+
+  @staticmethod
+  def RegridBlock(cube, block, regrid):
+    # Accumulate a block of files onto the grids of a copy of the regrid, only its sums and counts are returned
+    regrid.Partial(cube['velocity'][:, block], cube['frequency'][:, block], cube['ysignal'][:, block], block)
+    if regrid.dynamic_sum is not None:
+      regrid.DynamicPartial(cube['velocity'][:, block], cube['ysignal'][:, block], block)
+    return regrid
+
+  def Run(self, executor, function, blocks, *args):
+    # Run a stage on every block and wait for all of them
+    return [future.result() for future in [executor.submit(self.Stage, self.cube, function, block, *args) for block in blocks]]
+
+  def CalibrateData(self):
+    try:
+      channels, files = self.frequency.shape
+      # The polarized signal is formed here, then the signal and frequency are moved to shared memory
+      self.pol.Polarization(self.rhcp, self.lhcp)
+      self.pol.ysignal = self.cube.Create('ysignal', self.pol.ysignal.shape, self.pol.ysignal.dtype, self.pol.ysignal)
+      self.frequency = self.cube.Create('frequency', self.frequency.shape, self.frequency.dtype, self.frequency)
+      self.doppler.velocity = self.cube.Create('velocity', (channels, files), np.float64)
+      corrections = self.cube.Create('corrections', (files,), np.float64)
+      # One contiguous block of files (or channels) per worker
+      fileblocks, channelblocks = calibrations.KernelThreads.Blocks(files, o.workers), calibrations.KernelThreads.Blocks(channels, o.workers)
+      print(f'Calibrating {files} files in {len(fileblocks)} blocks with {o.workers} worker processes on shared memory')
+      with ProcessPoolExecutor(max_workers=o.workers, initializer=calibrations.KernelThreads.Limit, initargs=(1,)) as executor:
+        # The mean of every file has to be removed before the median of every channel is taken
+        if o.median:
+          self.Run(executor, self.CenterBlock, fileblocks)
+          self.Run(executor, self.MedianBlock, channelblocks)
+        else:
+          print('Warning: Median calibration was not utilized') # Warning if median calibration is not used
+        # The LSRK corrections are calculated in the workers, block by block, and kept for the parent
+        self.Run(executor, self.VelocityBlock, fileblocks, self.doppler, o.rfreq)
+        self.doppler.StoreCorrections(slice(None), corrections)
+        # The grids need the range of every velocity before any block is accumulated
+        self.regrid.MinMaxRange(self.doppler.velocity, self.frequency)
+        if o.dynamic or o.dynamicplot:
+          self.regrid.Epochs(self.fitsdata.metadata)
+        for partial in self.Run(executor, self.RegridBlock, fileblocks, self.regrid):
+          self.regrid.Merge(partial)
+      # Calculate the averages from the merged sums and counts
+      self.regrid.Average()
+      if o.cube:
+        self.StreamCube()
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.fitsdata.files}.')
+      quit()
+
+class StoredCalibrationSoftware(SpectralCalibrationSoftware):
+  # Stored Class, re-grids the calibrated arrays of a store saved by --store without reading any FITS file
+  def __init__(self, directory):
+    # Initialize the class with the store directory
+    self.directory = directory
+    self.cut = calibrations.ChannelCalibration()
+    # The store provides the metadata of its files in place of FITSHandler
+    self.fitsdata = controller.CalibratedStore(self.directory)
+    # The calibration parameters of the store replace the options, so plots and headers describe the stored data
+    o.polarization, o.median, o.rfreq = self.fitsdata.manifest['polarization'], self.fitsdata.manifest['median'], self.fitsdata.manifest['rfreq']
+    self.pol = calibrations.PolarizationCalibration()
+    self.doppler = calibrations.VelocityCalibration(self.fitsdata)
+    self.regrid = calibrations.RegridCalibration()
+    self.ProcessData()
+    self.CalibrateData()
+    self.UtilizeData()
+
+  def ProcessData(self):
+    try:
+      # Channels are the overlap of -c and the stored channels, relative to the first stored channel
+      ch0, ch1 = max(self.cut.ch0, self.fitsdata.ch0), min(self.cut.ch1, self.fitsdata.ch1)
+      if ch1 <= ch0:
+        raise ValueError(f'Channels {o.channels} are outside the stored channels {self.fitsdata.manifest["channels"]}')
+      self.cut.ch0, self.cut.ch1 = ch0, ch1
+      # The regridded channels replace the option as well, so the saved header and plots report them
+      o.channels = f'{ch0}:{ch1}'
+      rows = slice(ch0 - self.fitsdata.ch0, ch1 - self.fitsdata.ch0)
+      # Files observed between the start and end time, a contiguous range of files is sliced without a copy
+      columns = self.fitsdata.metadata.columns
+      start = np.datetime64(datetime.strptime(str(o.start), '%Y-%m-%dT%H:%M:%S'))
+      end = np.datetime64(datetime.strptime(str(o.end), '%Y-%m-%dT%H:%M:%S'))
+      files = np.flatnonzero((columns['DATE-OBS'] > start) & (columns['DATE-END'] < end))
+      if len(files) == 0:
+        raise ValueError(f'No stored files between {o.start} and {o.end}')
+      if files[-1] - files[0] + 1 == len(files):
+        files = slice(files[0], files[-1] + 1)
+      self.fitsdata.metadata = self.fitsdata.metadata.Select(files)
+      self.fitsdata.files = list(self.fitsdata.metadata.columns['file'])
+      self.fitsdata.filecount = self.fitsdata.count = len(self.fitsdata.files)
+      self.regrid.SetData(self.fitsdata.metadata, ch0)
+      # Views of the stored arrays, only the selected data is read from disk
+      self.frequency = self.fitsdata['frequency'][rows, files]
+      self.pol.ysignal = self.fitsdata['ysignal'][rows, files]
+      self.doppler.velocity = self.fitsdata['velocity'][rows, files]
+      self.channels = np.broadcast_to(np.arange(ch0, ch1)[:, np.newaxis], self.frequency.shape)
+      # Calculate and print the time taken to open the store
+      self.processtime = time.time() - self.fitsdata.process
+      print(f"Time to open store : {self.processtime:.4f}s ({self.fitsdata.count} files, channels {ch0}:{ch1})")
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.directory}.')
+      quit()
+
+  def CalibrateData(self):
+    try:
+      # The stored signal is already polarized, median removed and Doppler corrected, only the regrid is calculated
+      self.regrid.Regrid(
+        self.doppler.velocity, # Doppler-corrected velocity
+        self.frequency, # Frequency data
+        self.pol.ysignal, # Polarized signal
+        self.fitsdata.count # Stored file count
+      )
+      if o.dynamic or o.dynamicplot:
+        self.regrid.DynamicSpectrum(self.doppler.velocity, self.pol.ysignal, self.fitsdata.metadata)
+      if o.cube:
+        self.StreamCube()
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.directory}.')
+      quit()
+
+class RollupCalibrationSoftware(SpectralCalibrationSoftware):
+  # Rollup Class, serves a start/end time range from the partial regrids of the nights and months it covers
+  # Only the files of nights partly inside the range, and rollups that are missing, are read and calibrated
+  def __init__(self, directory):
+    # Initialize the class with the directory where data is stored
+    self.directory = directory
+    self.cut = calibrations.ChannelCalibration()
+    self.pol = calibrations.PolarizationCalibration()
+    # Rollups can only be merged when they are calibrated with the same parameters
+    self.store = controller.RollupStore(o.rollups,
+      channels=f'{self.cut.ch0}:{self.cut.ch1}',
+      polarization=self.pol.polarization,
+      rfreq=o.rfreq,
+      vgrid=o.vgrid,
+      fgrid=o.fgrid,
+      weight=o.weight,
+      mask=o.mask)
+    # Only the metadata is loaded here, the time range is applied per night and month
+    # The headers come from the index of the rollups, only the headers of new files are read
+    self.fitsdata = controller.FITSHandler(self.directory, self.cut.channels, load=False, times=False, index=self.store)
+    self.doppler = calibrations.VelocityCalibration(self.fitsdata)
+    self.regrid = calibrations.RegridCalibration()
+    self.regrid.SetData(self.fitsdata.metadata, self.cut.ch0)
+    self.ProcessData()
+    self.CalibrateData()
+    self.UtilizeData()
+
+  def ProcessData(self):
+    try:
+      # Rollups are summed bin for bin, so every file has to be calibrated on its own onto the same grids
+      if not self.regrid.Fixed():
+        raise ValueError('Rollups need fixed grids, use --vgrid and --fgrid')
+      if o.median or self.pol.polarization == 'B':
+        raise ValueError('Rollups can not be used with -m or -p B, they depend on every file in the range')
+      if o.dynamic or o.dynamicplot or o.cube:
+        print('Warning: The rollups only hold the averages, no dynamic spectrum or cube is calculated')
+      columns = self.fitsdata.metadata.columns
+      # Files observed between the start and end time, like the time filter of FITSHandler
+      start = np.datetime64(datetime.strptime(str(o.start), '%Y-%m-%dT%H:%M:%S'))
+      end = np.datetime64(datetime.strptime(str(o.end), '%Y-%m-%dT%H:%M:%S'))
+      self.inrange = (columns['DATE-OBS'] > start) & (columns['DATE-END'] < end)
+      if not np.any(self.inrange):
+        raise ValueError(f'No files between {o.start} and {o.end}')
+      # Nights run from noon to noon, like the nights of the dynamic spectrum and the inventory
+      self.nights = calibrations.RegridCalibration.Nights(columns['DATE-OBS'])
+      self.months = self.nights.astype('datetime64[M]')
+      # A month or night is served from its rollup when all of its files are in the range
+      self.rollups = []
+      edges = np.zeros(len(columns), dtype=bool)
+      for month in np.unique(self.months[self.inrange]):
+        files = self.months == month
+        if np.all(self.inrange[files]):
+          self.rollups.append((f'month_{month}', np.flatnonzero(files)))
+          continue
+        for night in np.unique(self.nights[files & self.inrange]):
+          files = self.nights == night
+          if np.all(self.inrange[files]):
+            self.rollups.append((f'night_{night}', np.flatnonzero(files)))
+          else:
+            # Files of a night partly inside the range are read at the edges
+            edges |= files & self.inrange
+      self.edges = np.flatnonzero(edges)
+      months = sum(key.startswith('month') for key, _ in self.rollups)
+      print(f'Range {o.start} - {o.end}: {months} months and {len(self.rollups) - months} nights from rollups, {len(self.edges)} files at the edges')
+      # Calculate and print the time taken to process the data
+      self.processtime = time.time() - self.fitsdata.process
+      print(f"Time to process : {self.processtime:.4f}s")
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.directory}.')
+      quit()
+
+  def Calibrate(self, files):
+    # Load and calibrate the files (columns), returning their velocity, frequency and polarized signal
+    frequency, rhcp, lhcp = self.fitsdata.LoadChunk([self.fitsdata.files[file] for file in files])
+    self.pol.Polarization(rhcp, lhcp)
+    return self.doppler.Doppler(frequency, columns=files), frequency, self.pol.ysignal
+
+  def Rollup(self, key, files):
+    # Path of the rollup of the files (columns), built when it is missing or its files changed
+    names = [os.path.relpath(self.fitsdata.files[file], self.directory) for file in files]
+    if self.store.Valid(key, names):
+      return self.store.Path(key)
+    regrid = calibrations.RegridCalibration()
+    regrid.SetData(self.fitsdata.metadata, self.cut.ch0)
+    if key.startswith('month'):
+      # A month is the sum of its nights, which are built first when needed
+      for night in np.unique(self.nights[files]):
+        regrid.MergePartial(self.Rollup(f'night_{night}', np.flatnonzero(self.nights == night)))
+    else:
+      regrid.Partial(*self.Calibrate(files), files)
+    regrid.SavePartial(self.store.Path(key), count=len(files))
+    self.store.Record(key, names)
+    self.built += 1
+    return self.store.Path(key)
+
+  def CalibrateData(self):
+    try:
+      start = time.time()
+      self.built = 0
+      # Merge the rollups covering the range, building the missing ones
+      for key, files in self.rollups:
+        self.regrid.MergePartial(self.Rollup(key, files))
+      self.store.Save()
+      # Accumulate the files at the edges of the range onto the same grids
+      if len(self.edges):
+        self.regrid.Partial(*self.Calibrate(self.edges), self.edges)
+      self.regrid.Average()
+      print(f'Time to merge : {time.time() - start:.4f}s ({len(self.rollups)} rollups, {self.built} built, {len(self.edges)} edge files)')
+      # Only the files in the range describe the product
+      self.fitsdata.metadata = self.fitsdata.metadata.Select(self.inrange)
+      self.fitsdata.files = [file for file, inrange in zip(self.fitsdata.files, self.inrange) if inrange]
+      self.fitsdata.filecount = self.fitsdata.count = len(self.fitsdata.files)
+      # Per file arrays are not loaded, only the regridded products are available
+      self.frequency, self.channels, self.pol.ysignal = None, None, None
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.directory}.')
+      quit()
+
+class SweepCalibrationSoftware:
+  # Sweep Class, evaluates every combination of the sweep options on data loaded once
+  def __init__(self, directory):
+    # Initialize the class with the directory where data is stored
+    self.directory = directory
+    # Expand the sweep options before any data is loaded so invalid values fail early
+    self.sweep = calibrations.SweepCalibration()
+    # Load the FITS data once for every combination, reading only the channels covered by the sweep
+    self.fitsdata = controller.FITSHandler(self.directory, self.sweep.Window())
+    # The LSRK corrections only depend on the files, so one VelocityCalibration is shared
+    self.doppler = calibrations.VelocityCalibration(self.fitsdata)
+    self.ProcessData()
+    self.SweepData()
+    self.UtilizeData()
+
+  def ProcessData(self):
+    try:
+      # Stack the data of all files into (channels, files) arrays covering the whole sweep window
+      self.frequency = np.array(self.fitsdata.frequencies).T
+      self.rhcp = np.array(self.fitsdata.rhcp).T
+      self.lhcp = np.array(self.fitsdata.lhcp).T
+      # Calculate the barycentric corrections once, they are shared by every combination
+      self.doppler.Corrections()
+      # Calculate and print the time taken to process the data
+      self.processtime = time.time() - self.fitsdata.process
+      print(f"Time to process : {self.processtime:.4f}s")
+    except (IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.fitsdata.files}.')
+      quit()
+
+  def CalibrateCombination(self, combination):
+    # Run the channel, polarization, median, velocity and regrid stages for a single combination
+    channels, rfreq, bins = combination
+    cut = calibrations.ChannelCalibration(channels)
+    pol = calibrations.PolarizationCalibration()
+    regrid = calibrations.RegridCalibration(bins)
+    regrid.SetData(self.fitsdata.metadata, cut.ch0)
+    # The loaded rows start at the first channel of the sweep window
+    ch0, ch1 = cut.ch0 - self.fitsdata.ch0, cut.ch1 - self.fitsdata.ch0
+    # Copy the sliced signals, the median calibration works in place on the shared cube otherwise
+    # The copies keep the column order of the loaded data, so the means and medians round like a single run
+    frequency = self.frequency[ch0:ch1]
+    pol.Polarization(self.rhcp[ch0:ch1].copy(order='F'), self.lhcp[ch0:ch1].copy(order='F'))
+    if o.median:
+      calibrations.MedianCalibration().Median(pol.ysignal)
+    # Velocity calibration reuses the shared LSRK corrections
+    velocity = self.doppler.Doppler(frequency, rfreq)
+    regrid.Regrid(velocity, frequency, pol.ysignal, self.fitsdata.count)
+    return regrid
+
+  def SweepData(self):
+    try:
+      start = time.time()
+      print(f'Calibrating {len(self.sweep.combinations)} combinations with {o.workers} workers')
+      # Evaluate the combinations in parallel on the in-memory data
+      with ThreadPoolExecutor(max_workers=o.workers) as executor:
+        self.regrids = list(executor.map(self.CalibrateCombination, self.sweep.combinations))
+      print(f"Time to calibrate: {time.time() - start:.4f}s")
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.sweep.combinations}.')
+      quit()
+
+  def UtilizeData(self):
+    try:
+      # Products are named from the output option, otherwise from the object and a timestamp
+      if o.output:
+        basename = os.path.splitext(o.output)[0]
+      else:
+        basename = f'{self.fitsdata.metadata[0]["OBJECT"]}_{datetime.now().strftime("%Y%m%d_%H%M%S")}_sweep'
+      saver = controller.FITSSaver(self.fitsdata)
+      rows = []
+      for idx, (combination, regrid) in enumerate(zip(self.sweep.combinations, self.regrids)):
+        row = {'ID': idx, **self.sweep.Summary(combination, regrid), 'FILE': None}
+        # Save one product per combination unless this is a test run
+        if not o.testrun:
+          row['FILE'] = f'{basename}_{idx:03d}.fits'
+          # The bin count is taken from the regrid, a fixed velocity grid replaces the swept bins
+          channels, rfreq, _ = combination
+          saver.SaveProduct(regrid, row['FILE'], channels, rfreq)
+        rows.append(row)
+      # Print the summary table
+      PrintTable(rows)
+      # Save the summary table next to the products
+      if not o.testrun:
+        with open(f'{basename}_summary.csv', 'w', newline='') as summary:
+          writer = csv.DictWriter(summary, fieldnames=list(rows[0]))
+          writer.writeheader()
+          writer.writerows(rows)
+        print(f'Summary saved as: {basename}_summary.csv')
+    except (Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : Utilization of sweep')
+      quit()
+
+class MultiLineCalibrationSoftware(SweepCalibrationSoftware):
+  # Multi-line Class, calibrates several spectral lines from the same loaded data
+  def __init__(self, directory):
+    # Initialize the class with the directory where data is stored
+    self.directory = directory
+    # Each line is evaluated as a combination of its channel window, rest frequency and the bin count
+    self.sweep = calibrations.LineCalibration()
+    # Load the FITS data and calculate the LSRK corrections once for every line, reading only the channels covered by the lines
+    self.fitsdata = controller.FITSHandler(self.directory, self.sweep.Window())
+    self.doppler = calibrations.VelocityCalibration(self.fitsdata)
+    self.ProcessData()
+    self.SweepData()
+    self.UtilizeData()
+
+  def UtilizeData(self):
+    try:
+      # Print a summary row for every line
+      rows = [{'LINE': idx + 1, **self.sweep.Summary(line, regrid)} for idx, (line, regrid) in enumerate(zip(self.sweep.combinations, self.regrids))]
+      PrintTable(rows)
+      # Save all lines into one file with one HDU per line
+      if (o.savedata or o.output) and not o.testrun:
+        filename = o.output or f'{self.fitsdata.metadata[0]["OBJECT"]}_{datetime.now().strftime("%Y%m%d_%H%M%S")}_lines.fits'
+        controller.FITSSaver(self.fitsdata).SaveLines(self.regrids, self.sweep.combinations, filename)
+    except (Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : Utilization of lines')
+      quit()
+
+class InventorySoftware:
+  # Inventory Class, summarizes what an archive holds from the headers of every file, without loading any data
+  def __init__(self, directory):
+    # Initialize the class with the directory where data is stored
+    self.directory = directory
+    # Read the headers of every file, the filtering options are not applied to the inventory
+    self.fitsdata = controller.FITSHandler(self.directory, load=False, filter=False)
+    self.ProcessData()
+    self.UtilizeData()
+
+  def ProcessData(self):
+    try:
+      columns = self.fitsdata.metadata.columns
+      # Nights run from noon to noon, like the nights of the dynamic spectrum
+      nights = calibrations.RegridCalibration.Nights(columns['DATE-OBS'])
+      # Group the files on object, telescope, centre frequency and night
+      keys = np.empty(len(columns), dtype=[('OBJECT', columns['OBJECT'].dtype), ('TELESCOP', columns['TELESCOP'].dtype), ('FREQ', columns['FREQ'].dtype), ('NIGHT', nights.dtype)])
+      keys['OBJECT'], keys['TELESCOP'], keys['FREQ'], keys['NIGHT'] = columns['OBJECT'], columns['TELESCOP'], columns['FREQ'], nights
+      groups, inverse = np.unique(keys, return_inverse=True)
+      # Time coverage, elevation range and observing time of every group
+      start = np.full(len(groups), np.iinfo(np.int64).max)
+      np.minimum.at(start, inverse, columns['DATE-OBS'].view(np.int64))
+      end = np.full(len(groups), np.iinfo(np.int64).min)
+      np.maximum.at(end, inverse, columns['DATE-END'].view(np.int64))
+      elmin = np.full(len(groups), np.inf)
+      np.minimum.at(elmin, inverse, np.minimum(columns['EL-BEG'], columns['EL-END']))
+      elmax = np.full(len(groups), -np.inf)
+      np.maximum.at(elmax, inverse, np.maximum(columns['EL-BEG'], columns['EL-END']))
+      hours = np.bincount(inverse, weights=(columns['DATE-END'] - columns['DATE-OBS']) / np.timedelta64(1, 'h'), minlength=len(groups))
+      self.rows = [{
+        'OBJECT': str(group['OBJECT']),
+        'TELESCOP': str(group['TELESCOP']),
+        'FREQ': float(group['FREQ']),
+        'NIGHT': str(group['NIGHT']),
+        'FILES': int(files),
+        'START': str(np.datetime64(int(first), 's')),
+        'END': str(np.datetime64(int(last), 's')),
+        'EL_MIN': float(low),
+        'EL_MAX': float(high),
+        'HOURS': float(total)
+      } for group, files, first, last, low, high, total in zip(groups, np.bincount(inverse, minlength=len(groups)), start, end, elmin, elmax, hours)]
+      self.processtime = time.time() - self.fitsdata.process
+    except (ValueError, IndexError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.directory}.')
+      quit()
+
+  def UtilizeData(self):
+    try:
+      # Print the groups followed by the totals of the archive
+      PrintTable(self.rows)
+      columns = self.fitsdata.metadata.columns
+      print(f'Files: {len(columns)}, Groups: {len(self.rows)}, Objects: {len(np.unique(columns["OBJECT"]))}, Telescopes: {len(np.unique(columns["TELESCOP"]))}')
+      print(f'Coverage: {np.min(columns["DATE-OBS"])} - {np.max(columns["DATE-END"])}')
+      print(f'Time to scan : {self.processtime:.4f}s')
+      # Export the groups as JSON or CSV, depending on the extension of the output
+      if o.output:
+        with open(o.output, 'w', newline='') as inventory:
+          if os.path.splitext(o.output)[1].lower() == '.json':
+            json.dump(self.rows, inventory, indent=2)
+          else:
+            writer = csv.DictWriter(inventory, fieldnames=list(self.rows[0]))
+            writer.writeheader()
+            writer.writerows(self.rows)
+        print(f'Inventory saved as: {o.output}')
+    except (Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : Utilization of inventory')
+      quit()
+
+class ReplotSoftware:
+  # Replot Class, plots the regridded views of saved products, reading only their tables
+  def __init__(self, products):
+    # Initialize the class with the comma separated products, each may be a glob pattern
+    self.products = products
+    self.process = time.time()
+    self.ProcessData()
+    self.UtilizeData()
+
+  def ProcessData(self):
+    try:
+      # Expand the patterns in the given order, a name that matches nothing is opened as given to report it
+      files = [file for pattern in self.products.split(',') for file in (sorted(glob.glob(pattern)) or [pattern])]
+      # Every line of a multi-line product is a product of its own
+      self.saved = [product for file in files for product in controller.SavedProduct.Open(file)]
+      self.processtime = time.time() - self.process
+      print(f'Time to open : {self.processtime:.4f}s ({len(self.saved)} products)')
+    except (ValueError, Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : {self.products}.')
+      quit()
+
+  def UtilizeData(self):
+    try:
+      start = time.time()
+      plotting.ReplotUI(self.saved)
+      print(f'Time to plot : {time.time() - start:.4f}s')
+    except (Exception) as e:
+      # Handle errors
+      print(f'Error : {e},\nOccured in : {sys._getframe().f_code.co_name},\nWith : Utilization of replot')
+      quit()
+
 if __name__ == "__main__":
   try:
+    # All polarization products are only calculated on data loaded in memory
+    if str(o.polarization).upper() == 'A' and any((o.fromstore, o.store, o.rollups, o.lines, o.sweepbins, o.sweepchannels, o.sweeprfreq, o.interactive, o.shards, o.sharedmemory, o.memory)):
+      raise ValueError('-p A is only available for in-memory processing, without stores, rollups, sweeps, lines, the explorer, --shards, --shm or --mem')
+    # The dynamic spectrum and the cube hold a single product
+    if str(o.polarization).upper() == 'A' and (o.dynamic or o.dynamicplot or o.cube):
+      raise ValueError('-p A can not be used with --dyn, --DS or --cube, they hold a single polarization product')
+    # Plot saved products if they are given, nothing is processed
+    if o.replot:
+      ReplotSoftware(o.replot)
+    # Re-grid a store of calibrated arrays if one is given
+    elif o.fromstore:
+      start = time.time()
+      StoredCalibrationSoftware(o.fromstore)
     # Check if a directory is provided through the options
-    if o.directory:
+    elif o.directory:
       # Record the start time before initializing the software
       start = time.time()
-      # Create an instance of SpectralCalibrationSoftware with the provided directory
-      SpectralCalibrationSoftware(o.directory)
+      # Summarize the archive from the file headers if an inventory is requested
+      if o.inventory:
+        InventorySoftware(o.directory)
+      # Serve the time range from the rollups if a rollup directory is given
+      elif o.rollups:
+        RollupCalibrationSoftware(o.directory)
+      # Process several spectral lines if the lines option is given
+      elif o.lines:
+        MultiLineCalibrationSoftware(o.directory)
+      # Run a parameter sweep if any sweep option is given
+      elif o.sweepbins or o.sweepchannels or o.sweeprfreq:
+        SweepCalibrationSoftware(o.directory)
+      # Explore the data interactively if requested
+      elif o.interactive:
+        InteractiveCalibrationSoftware(o.directory)
+      # Process shards of the files in worker processes if a shard count is given
+      elif o.shards:
+        ShardedCalibrationSoftware(o.directory)
+      # Calibrate in worker processes sharing the loaded data if requested
+      elif o.sharedmemory:
+        SharedCalibrationSoftware(o.directory)
+      # Process the files out-of-core if a memory budget is given
+      elif o.memory:
+        ChunkedCalibrationSoftware(o.directory)
+      else:
+        # Create an instance of SpectralCalibrationSoftware with the provided directory
+        SpectralCalibrationSoftware(o.directory)
     else:
       # Raise an error if no directory is provided
       raise ValueError('Software missing commands, please use -h for help') 
@@ -1,3 +1,4 @@
+import os
 import sys
 import datetime
 import globals
@@ -14,6 +15,8 @@ processing_group = OptionGroup(o, "Plotting options", "Various options for proce
 plotting_group = OptionGroup(o, "Axes options", "Options for selecting data to plot in subplot 2")
 utility_group = OptionGroup(o, "Utility options", "Miscellaneous utility options")
 saving_group = OptionGroup(o, "File Saving options", "Options for saving data to a FITS file")
+sweep_group = OptionGroup(o, "Sweep options", "Options for evaluating several processing parameters on data loaded once")
+performance_group = OptionGroup(o, "Performance options", "Options for processing large archives out-of-core or in parallel")
 
 # Directory 
 
@@ -24,6 +27,27 @@ directory_group.add_option('-d', '--directory',
   metavar='<directory>',
   help='Specify a directory path to utilize and process in the software')
 
+directory_group.add_option('--include', '--includefiles',
+  dest='include',
+  type=str,
+  default=None,
+  metavar='GLOB,GLOB',
+  help='Only process FITS files whose name or path relative to the directory matches one of these patterns, defaults to every FITS file, Ex: 2023*, 2024/03/*')
+
+directory_group.add_option('--exclude', '--excludefiles',
+  dest='exclude',
+  type=str,
+  default=None,
+  metavar='GLOB,GLOB',
+  help='Skip files and subdirectories whose name or relative path matches one of these patterns, Ex: *.log,tmp, calibration/*')
+
+directory_group.add_option('--depth', '--maxdepth',
+  dest='depth',
+  type=int,
+  default=None,
+  metavar='2',
+  help='Deepest subdirectory level searched for files, 0 searches only the directory itself, defaults to the whole tree, Ex: 0, 2')
+
 # Filtering
 
 filtering_group.add_option('--fc', '--centrefreqrange',
@@ -74,8 +98,8 @@ processing_group.add_option('-p', '--polarization',
   dest='polarization',
   type=str,
   default='R',
-  metavar='r, R, l, L, b, B',
-  help='Specify the polarization to process, Ex: (r, R = Right) (l, L = Left) (b, B = Both)')
+  metavar='r, R, l, L, b, B, a, A',
+  help='Specify the polarization to process, Ex: (r, R = Right) (l, L = Left) (b, B = Both) (a, A = All: R, L, B and R-L in one run)')
 
 processing_group.add_option('--fr','--restfreq',
   dest='rfreq',
@@ -91,6 +115,43 @@ processing_group.add_option('-b', '--bins',
   metavar='500',
   help='Define the total channels(bins) to re-grid frequency & velocity data into, Ex: 500, 750, 5000')
 
+processing_group.add_option('--vgrid', '--velocitygrid',
+  dest='vgrid',
+  type=str,
+  default=None,
+  metavar='VMIN:VMAX:DV [km/s]',
+  help='Re-grid velocity data onto a fixed grid instead of one derived from the data, values outside it are ignored, Ex: -30:10:0.05')
+
+processing_group.add_option('--fgrid', '--frequencygrid',
+  dest='fgrid',
+  type=str,
+  default=None,
+  metavar='FMIN:FMAX:DF [MHz]',
+  help='Re-grid frequency data onto a fixed grid instead of one derived from the data, values outside it are ignored, Ex: 6668:6669:0.001')
+
+processing_group.add_option('-w', '--weight',
+  dest='weight',
+  type='choice',
+  choices=['time', 'elevation'],
+  default=None,
+  metavar='time, elevation',
+  help='Weight every file in the regrid by its integration time or by the sine of its start elevation, Ex: time, elevation')
+
+processing_group.add_option('--mask', '--channelmask',
+  dest='mask',
+  type=str,
+  default=None,
+  metavar='CH:CH,CH:CH',
+  help='Exclude channel ranges, for example with RFI, from the regrid, Ex: 1200:1210,2950:3000')
+
+processing_group.add_option('--dyn', '--dynamic',
+  dest='dynamic',
+  type='choice',
+  choices=['file', 'night'],
+  default=None,
+  metavar='file, night',
+  help='Calculate a dynamic (time x velocity) spectrum with one row per file or per observing night, Ex: file, night')
+
 processing_group.add_option('-m', '--median',
   dest='median',
   action='store_true',
@@ -147,6 +208,12 @@ plotting_group.add_option('-B', '--bybins',
   default=False,
   help='Plot total frequency bins contributing to the regridding')
 
+plotting_group.add_option('--DS', '--bydynamic',
+  dest='dynamicplot',
+  action='store_true',
+  default=False,
+  help='Plot the dynamic (time x velocity) spectrum, one row per file unless --dyn is given')
+
 # Utility
 
 processing_group.add_option('--fig', '--figuresize',
@@ -174,6 +241,25 @@ utility_group.add_option('--dbg', '--debug',
   default=False,
   help='Debug and print relevant information from loaded FITS files')
 
+utility_group.add_option('--inv', '--inventory',
+  dest='inventory',
+  action='store_true',
+  default=False,
+  help='Summarize the headers of every file in the directory per object, telescope, centre frequency and night, -o exports the summary as .csv or .json')
+
+utility_group.add_option('--rp', '--replot',
+  dest='replot',
+  type=str,
+  default=None,
+  metavar='FILE,FILE',
+  help='Plot the regridded views of saved products without processing, several products are overlaid, -o saves the figure, Ex: a.fits,b.fits, products/*.fits')
+
+utility_group.add_option('-i', '--interactive',
+  dest='interactive',
+  action='store_true',
+  default=False,
+  help='Explore the regridded spectrum interactively, changing bins, channel window and polarization with widgets or keys')
+
 utility_group.add_option('--sub', '--subplot',
   dest='subplotlabel',
   action='store_true',
@@ -194,6 +280,34 @@ saving_group.add_option('--sv', '--savedata',
   default=False,
   help='Save the processed data to a FITS file')
 
+saving_group.add_option('--store', '--savestore',
+  dest='store',
+  type=str,
+  default=None,
+  metavar='<directory>',
+  help='Save the calibrated signal, frequency and velocity of every file as .npy files with a manifest to this directory')
+
+saving_group.add_option('--fromstore', '--loadstore',
+  dest='fromstore',
+  type=str,
+  default=None,
+  metavar='<directory>',
+  help='Re-grid, plot or save the calibrated data of a store instead of processing FITS files, -c, -s and -e select a subset')
+
+saving_group.add_option('--rollups', '--rollupstore',
+  dest='rollups',
+  type=str,
+  default=None,
+  metavar='<directory>',
+  help='Serve the -s/-e range from per night and per month partial regrids kept in this directory, built when missing, needs --vgrid and --fgrid')
+
+saving_group.add_option('--cube', '--savecube',
+  dest='cube',
+  type=str,
+  default=None,
+  metavar='cube.fits',
+  help='Stream the regridded spectrum of every file, or every night with --dyn night, as rows of a FITS image while the data is calibrated')
+
 saving_group.add_option('--pr', '--print',
   dest='printdata',
   action='store_true',
@@ -207,6 +321,100 @@ saving_group.add_option('-o', '--output',
   metavar='output.fits',
   help='Save the processed data to a user defined FITS file, Ex: testfile, maser, G232')
 
+# Sweep
+
+sweep_group.add_option('--sb', '--sweepbins',
+  dest='sweepbins',
+  type=str,
+  default=None,
+  metavar='500,1000 or 500:2000:500',
+  help='Sweep over a list or start:stop:step range of bin counts, a fixed --vgrid replaces them, Ex: 500,750,1000 or 500:2000:500')
+
+sweep_group.add_option('--sc', '--sweepchannels',
+  dest='sweepchannels',
+  type=str,
+  default=None,
+  metavar='CH:CH,CH:CH',
+  help='Sweep over a comma separated list of channel ranges, Ex: 290:3800,1800:2300')
+
+sweep_group.add_option('--sfr', '--sweeprestfreq',
+  dest='sweeprfreq',
+  type=str,
+  default=None,
+  metavar='6668.5192,6667.0 [MHz]',
+  help='Sweep over a list or start:stop:step range of rest frequencies, Ex: 6668.5192,6668.6 or 6668.4:6668.6:0.1')
+
+sweep_group.add_option('--ml', '--lines',
+  dest='lines',
+  type=str,
+  default=None,
+  metavar='RESTFREQ:CH:CH,RESTFREQ:CH:CH',
+  help='Process several spectral lines in one pass, each with its own rest frequency [MHz] and channel window, Ex: 6668.5192:1800:2300,6667.9:900:1400')
+
+sweep_group.add_option('-j', '--workers',
+  dest='workers',
+  type=int,
+  default=os.cpu_count(),
+  metavar='4',
+  help='Number of parallel workers used for sweeps, lines, shards, shared memory stages and header reads, Ex: 4, 8, 32')
+
+# Performance
+
+performance_group.add_option('--mem', '--memorybudget',
+  dest='memory',
+  type=float,
+  default=None,
+  metavar='4096 [MB]',
+  help='Process the files out-of-core in chunks fitting this memory budget, using scratch files on disk, Ex: 2048, 16000')
+
+performance_group.add_option('--scratch', '--scratchdir',
+  dest='scratch',
+  type=str,
+  default=None,
+  metavar='<directory>',
+  help='Directory for the out-of-core scratch files, defaults to the system temporary directory')
+
+performance_group.add_option('--prefetch', '--prefetchdepth',
+  dest='prefetch',
+  type=int,
+  default=4,
+  metavar='4',
+  help='Number of files read ahead by background threads while loaded files are handled, 0 reads synchronously, Ex: 0, 4, 16')
+
+performance_group.add_option('--shards', '--shardcount',
+  dest='shards',
+  type=int,
+  default=None,
+  metavar='8',
+  help='Split the files into shards processed by --workers processes and merge their partial results, Ex: 8, 32')
+
+performance_group.add_option('--sharddir', '--sharddirectory',
+  dest='sharddir',
+  type=str,
+  default=None,
+  metavar='<directory>',
+  help='Directory for the shard extent and partial files, defaults to a temporary directory')
+
+performance_group.add_option('--threads', '--kernelthreads',
+  dest='threads',
+  type=int,
+  default=os.cpu_count(),
+  metavar='4',
+  help='Number of threads used by the median and regrid kernels on blocks of channels or files, 1 runs single threaded, Ex: 1, 8, 32')
+
+performance_group.add_option('--scanthreads', '--discoverythreads',
+  dest='scanthreads',
+  type=int,
+  default=min(32, (os.cpu_count() or 1) + 4),
+  metavar='8',
+  help='Number of threads listing subdirectories concurrently while discovering the files, 1 scans single threaded, Ex: 1, 16, 64')
+
+performance_group.add_option('--shm', '--sharedmemory',
+  dest='sharedmemory',
+  action='store_true',
+  default=False,
+  help='Run the median, velocity and regrid stages in --workers processes attached to the loaded data through shared memory')
+
 # Add Option Group
 
 o.add_option_group(directory_group)
@@ -215,6 +423,8 @@ o.add_option_group(processing_group)
 o.add_option_group(plotting_group)
 o.add_option_group(utility_group)
 o.add_option_group(saving_group)
+o.add_option_group(sweep_group)
+o.add_option_group(performance_group)
 
 # Parse Arguments
 
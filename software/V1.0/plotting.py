@@ -1,7 +1,11 @@
 # Imports
 import matplotlib.pyplot as plt
 import os
+import time
+import numpy as np
 import globals
+import calibrations
+from matplotlib.widgets import Slider, RangeSlider, RadioButtons
 from datetime import datetime
 from options import o
 
@@ -21,6 +25,9 @@ class PlotUI:
     self.frequency = frequency  # Frequency data
     self.channels = channels  # Channels data
     self.ysignal = ysignal  # Signal data
+    # With all polarization products the per file plots show the first product, R
+    if np.ndim(self.ysignal) == 3:
+      self.ysignal = self.ysignal[0]
     self.symbol = '-'  # Default line style for plots
     # Set up the plots with basic configurations
     self.PlotSetup()
@@ -46,7 +53,15 @@ class PlotUI:
   # Main method to plot the data based on various conditions
     def PlotFeatures(ax, x, y, title, xlabel, ylabel):
       # Helper function to plot features on a given axis
-      ax.plot(x, y)  # Plot x vs. y on the provided axis
+      # Regridded arrays of all polarization products have one row per product, plotted as one line each
+      if np.ndim(y) == 2 and np.ndim(x) == 1:
+        ax.plot(x, np.transpose(y), label=list(calibrations.PolarizationCalibration.products))
+        ax.legend()
+      elif np.ndim(x) == 2 and isinstance(y, str):
+        ax.plot(np.transpose(x), y, label=list(calibrations.PolarizationCalibration.products))
+        ax.legend()
+      else:
+        ax.plot(x, y)  # Plot x vs. y on the provided axis
       ax.set_title(title)  # Set the title of the plot
       ax.set_xlabel(xlabel)  # Set the x-axis label
       ax.set_ylabel(ylabel)  # Set the y-axis label  
@@ -133,6 +148,9 @@ class PlotUI:
         title=None,
         xlabel=f'Channels [{o.channels}]',
         ylabel='Power [ADU]')
+    elif o.dynamicplot:
+      # Plot the dynamic spectrum as an image of epochs against regridded velocity
+      self.PlotDynamic(self.regrid)
     elif o.binplot:
       # Plot bin count data if the option is enabled
       PlotFeatures(self.axes,
@@ -152,6 +170,22 @@ class PlotUI:
     # Display the plot
     plt.show()
       
+  def PlotDynamic(self, regrid):
+    # Plot the (epochs, bins) dynamic spectrum of a regrid as an image of epochs against regridded velocity
+    velocity = getattr(regrid.velo_fr, 'value', regrid.velo_fr)
+    image = self.axes.imshow(regrid.dynamic,
+      aspect='auto',
+      origin='lower',
+      interpolation='nearest',
+      extent=(velocity[0], velocity[-1], -0.5, len(regrid.epochs) - 0.5))
+    self.fig.colorbar(image, ax=self.axes, label='Power [ADU]')
+    # Label the rows with their epochs, limited to a readable amount of ticks
+    ticks = np.unique(np.linspace(0, len(regrid.epochs) - 1, min(10, len(regrid.epochs))).astype(int))
+    self.axes.set_yticks(ticks)
+    self.axes.set_yticklabels([str(regrid.epochs[tick]) for tick in ticks])
+    self.axes.set_xlabel(r'Gridded velocity, $v_\mathrm{LSRK}$ [km s$^{-1}$]')
+    self.axes.set_ylabel('Epoch')
+
   def PlotMetaData(self):
       # Method to plot metadata information on the figure
       # Get the final index of the metadata
@@ -169,6 +203,8 @@ class PlotUI:
         pol = 'RHCP'  # Right Hand Circular Polarization
       elif o.polarization == 'l' or o.polarization == 'L':
         pol = 'LHCP'  # Left Hand Circular Polarization
+      elif o.polarization == 'a' or o.polarization == 'A':
+        pol = 'RHCP, LHCP, RHCP+LHCP, RHCP-LHCP'  # All polarization products
       else:
         pol = None  # No polarization specified or error occured
       # Software-related information to display in the metadata
@@ -195,4 +231,210 @@ class PlotUI:
       # Add the software information text to the figure at the specified position
       self.fig.text(0.15, 0.001, software, fontsize=8)
       # Add the metadata information text to the figure at the specified position
-      self.fig.text(0.001, 0.001, metadata, fontsize=8)
\ No newline at end of file
+      self.fig.text(0.001, 0.001, metadata, fontsize=8)
+class ExplorerUI(PlotUI):
+  # Class to explore the regridded spectrum interactively, keeping the loaded data resident in memory
+  def __init__(self, fitsdata, doppler, frequency, channels, rhcp, lhcp):
+    # Initialize the attributes with provided parameters
+    self.fitsdata = fitsdata  # FITS data object containing metadata and data
+    self.doppler = doppler  # Doppler object holding the velocity of every loaded channel
+    self.frequency = frequency  # Frequency data of the loaded channels
+    self.channels = channels  # Channels data of the loaded channels
+    self.rhcp = rhcp  # Uncalibrated RHCP data
+    self.lhcp = lhcp  # Uncalibrated LHCP data
+    # Explored parameters, starting from the options
+    self.bins = o.bins
+    self.first = int(self.channels[0, 0])  # First loaded channel
+    self.window = [0, len(self.frequency)]  # Channel window relative to the first loaded channel
+    self.polarization = str(o.polarization).upper()
+    # Set the figure size if enabled by options, leaving room for the widgets
+    self.figx, self.figy = map(int, o.figsize.split(':'))
+    self.fig, self.axes = plt.subplots(figsize=(self.figx, self.figy))
+    self.fig.subplots_adjust(bottom=0.25, left=0.15)
+    self.labelsize = min(25, 35 / (2 + 1))
+    self.symbol = '-'
+    self.background = None
+    self.PlotSetup()
+    self.PlotWidgets()
+    # Calculate and draw the initial spectrum
+    self.Update(rescale=True)
+    if o.plotmetadata:
+      self.PlotMetaData()
+    plt.show()
+
+  def PlotWidgets(self):
+    # Keys used by the explorer replace the default matplotlib key bindings
+    for keymap in [key for key in plt.rcParams if key.startswith('keymap.')]:
+      plt.rcParams[keymap] = [key for key in plt.rcParams[keymap] if key not in ('up', 'down', 'left', 'right', '+', '-', 'r', 'l', 'b', 'a')]
+    # The regridded line and the status text are animated, so they can be redrawn with blitting
+    self.line, = self.axes.plot([], [], self.symbol, animated=True)
+    self.status = self.axes.text(0.01, 0.98, '', transform=self.axes.transAxes, va='top', fontsize=9, animated=True)
+    self.axes.set_xlabel('Gridded frequency [MHz]' if o.regridfreqplot else r'Gridded velocity, $v_\mathrm{LSRK}$ [km s$^{-1}$]')
+    self.axes.set_ylabel('Power [ADU]')
+    # Sliders for the bin count and the channel window, values are shown in the status text
+    self.binslider = Slider(self.fig.add_axes((0.22, 0.12, 0.65, 0.03)), 'Bins', 10, max(10, 4 * o.bins), valinit=self.bins, valstep=1)
+    self.chanslider = RangeSlider(self.fig.add_axes((0.22, 0.07, 0.65, 0.03)), 'Channels', 0, len(self.frequency), valinit=self.window, valstep=1)
+    self.polbuttons = RadioButtons(self.fig.add_axes((0.01, 0.01, 0.07, 0.15)), ('R', 'L', 'B'), active='RLB'.index(self.polarization))
+    # Widgets are redrawn by the explorer together with the spectrum instead of redrawing the whole figure
+    for widget in (self.binslider, self.chanslider, self.polbuttons):
+      widget.drawon = False
+    for slider in (self.binslider, self.chanslider):
+      slider.valtext.set_visible(False)
+    self.binslider.on_changed(lambda value: self.SetParameters(bins=int(value)))
+    self.chanslider.on_changed(lambda value: self.SetParameters(window=[int(value[0]), int(value[1])]))
+    self.polbuttons.on_clicked(lambda label: self.SetParameters(polarization=label))
+    self.fig.canvas.mpl_connect('key_press_event', self.OnKey)
+    self.fig.canvas.mpl_connect('draw_event', self.OnDraw)
+    print('Explorer keys: up/down bins, left/right move window, +/- widen/narrow window, r/l/b polarization, a rescale')
+
+  def OnKey(self, event):
+    # Keyboard control of the explored parameters, updated through the widgets
+    width = self.window[1] - self.window[0]
+    step = max(1, width // 10)
+    if event.key == 'up':
+      self.binslider.set_val(min(self.binslider.valmax, round(self.bins * 1.25)))
+    elif event.key == 'down':
+      self.binslider.set_val(max(self.binslider.valmin, round(self.bins / 1.25)))
+    elif event.key in ('left', 'right'):
+      shift = -min(step, self.window[0]) if event.key == 'left' else min(step, len(self.frequency) - self.window[1])
+      self.chanslider.set_val((self.window[0] + shift, self.window[1] + shift))
+    elif event.key in ('+', '-'):
+      change = step if event.key == '+' else -min(step, (width - 2) // 2)
+      self.chanslider.set_val((max(0, self.window[0] - change), min(len(self.frequency), self.window[1] + change)))
+    elif event.key in ('r', 'l', 'b'):
+      self.polbuttons.set_active('RLB'.index(event.key.upper()))
+    elif event.key == 'a':
+      self.Update(rescale=True)
+
+  def SetParameters(self, bins=None, window=None, polarization=None):
+    # Store the changed parameter and update the spectrum
+    self.bins = bins or self.bins
+    self.polarization = polarization or self.polarization
+    if window is not None and window[1] > window[0]:
+      self.window = window
+    self.Update()
+
+  def Calibrate(self):
+    # Re-run the polarization, median and regrid calibrations on the channel window of the resident data
+    ch0, ch1 = self.window
+    copy = o.median and self.polarization != 'B'
+    pol = calibrations.PolarizationCalibration()
+    pol.polarization = self.polarization
+    pol.Polarization(self.rhcp[ch0:ch1].copy(order='F') if copy else self.rhcp[ch0:ch1], self.lhcp[ch0:ch1].copy(order='F') if copy else self.lhcp[ch0:ch1])
+    if o.median:
+      calibrations.MedianCalibration().Median(pol.ysignal)
+    regrid = calibrations.RegridCalibration(self.bins)
+    # The window starts at a row of the resident data, the channel numbers give its first channel
+    regrid.SetData(self.fitsdata.metadata, int(self.channels[ch0, 0]))
+    regrid.Regrid(self.doppler.velocity[ch0:ch1], self.frequency[ch0:ch1], pol.ysignal, self.fitsdata.count)
+    if o.regridfreqplot:
+      return regrid.freq_fr, regrid.average_fr
+    return getattr(regrid.velo_fr, 'value', regrid.velo_fr), regrid.average_vr
+
+  def Update(self, rescale=False):
+    # Calculate the spectrum for the current parameters and redraw it
+    start = time.perf_counter()
+    x, y = self.Calibrate()
+    self.line.set_data(x, y)
+    self.status.set_text(f'Bins: {self.bins}, Channels: {self.first + self.window[0]}:{self.first + self.window[1]}, '
+                         f'Polarization: {self.polarization}, Update: {(time.perf_counter() - start) * 1000:.1f} ms')
+    # The axes are rescaled when the spectrum no longer fits the view, otherwise only the changed artists are blitted
+    finite = np.isfinite(y)
+    if rescale or self.background is None or not self.InView(x[finite], y[finite]):
+      self.axes.relim()
+      self.axes.autoscale_view()
+      self.fig.canvas.draw_idle()
+    else:
+      self.Blit()
+
+  def InView(self, x, y):
+    # Check that the spectrum lies within the current view and fills at least a third of it
+    if len(x) == 0:
+      return True
+    (x0, x1), (y0, y1) = self.axes.get_xlim(), self.axes.get_ylim()
+    inside = min(x) >= min(x0, x1) and max(x) <= max(x0, x1) and min(y) >= y0 and max(y) <= y1
+    return inside and (max(y) - min(y)) > (y1 - y0) / 3 and (max(x) - min(x)) > abs(x1 - x0) / 3
+
+  def OnDraw(self, event):
+    # Store the background without the animated artists after a full redraw, then draw them on top
+    self.background = self.fig.canvas.copy_from_bbox(self.axes.bbox)
+    self.axes.draw_artist(self.line)
+    self.axes.draw_artist(self.status)
+
+  def Blit(self):
+    # Redraw only the spectrum, the status text and the widgets
+    canvas = self.fig.canvas
+    canvas.restore_region(self.background)
+    self.axes.draw_artist(self.line)
+    self.axes.draw_artist(self.status)
+    canvas.blit(self.axes.bbox)
+    for widget in (self.binslider, self.chanslider, self.polbuttons):
+      self.fig.draw_artist(widget.ax)
+      canvas.blit(widget.ax.bbox)
+
+class ReplotUI(PlotUI):
+  # Class to plot the regridded views of saved products without the raw files, several products are overlaid
+  def __init__(self, products):
+    # Initialize the attributes with the opened products, each standing in for a RegridCalibration
+    self.products = products
+    self.figx, self.figy = map(int, o.figsize.split(':'))
+    self.fig, self.axes = plt.subplots(figsize=(self.figx, self.figy))
+    self.labelsize = min(25, 35 / (2 + 1))
+    self.symbol = '-'
+    self.PlotSetup()
+    self.PlotData()
+
+  def PlotData(self):
+    # Title with the objects and the time covered by all products
+    objects = ', '.join(dict.fromkeys(str(product.header.get('OBJECT', '')).upper() for product in self.products))
+    first = min(str(product.header.get('DATE-OBS', ''))[:10] for product in self.products)
+    last = max(str(product.header.get('DATE-END', ''))[:10] for product in self.products)
+    self.fig.suptitle(f"{objects}, {first if first == last else f'{first} -> {last}'}", fontsize=17, fontweight='bold')
+    if o.veloplot or o.freqplot or o.chanplot:
+      print('Warning: Per file views need the calibrated arrays, the saved regridded views are plotted instead')
+    if o.sumfrplot:
+      print('Warning: The frequency sums are not saved, the regridded frequency average is plotted instead')
+    if o.dynamicplot:
+      # The dynamic spectrum is an image, only the first product with one is shown
+      product = next((product for product in self.products if product.dynamic is not None), None)
+      if product is None:
+        raise ValueError('No product holds a dynamic spectrum, save it with --dyn')
+      self.PlotDynamic(product)
+    else:
+      for product in self.products:
+        x, y, xlabel, ylabel = self.View(product)
+        # Products saved with -p A hold one row per polarization product
+        if np.ndim(y) == 2:
+          for name, row in zip(product.products, y):
+            self.axes.plot(x, row, self.symbol, label=f'{product.label} {name}')
+        else:
+          self.axes.plot(x, y, self.symbol, label=product.label)
+      self.axes.set_xlabel(xlabel)
+      self.axes.set_ylabel(ylabel)
+      if len(self.axes.lines) > 1:
+        self.axes.legend()
+    # Print the processing parameters of every product if the option is enabled
+    if o.plotmetadata:
+      self.PlotMetaData()
+    # Save the figure when an output is given, otherwise display it
+    if o.output:
+      self.fig.savefig(o.output, bbox_inches='tight')
+      print(f'Figure saved as: {o.output}')
+    else:
+      plt.show()
+
+  def View(self, product):
+    # Grid, values and axis labels of the selected view, the regridded velocity by default
+    if o.regridfreqplot or o.sumfrplot:
+      return product.freq_fr, product.average_fr, 'Gridded frequency [MHz]', 'Power [ADU]'
+    if o.sumvrplot:
+      return product.velo_fr, product.sum_vr, r'Gridded velocity, $v_\mathrm{LSRK}$ [km s$^{-1}$]', 'Summed power [ADU]'
+    if o.binplot:
+      return np.arange(len(product.count_vr)), product.count_vr, 'Bin number', 'Number of measurements'
+    return product.velo_fr, product.average_vr, r'Gridded velocity, $v_\mathrm{LSRK}$ [km s$^{-1}$]', 'Power [ADU]'
+
+  def PlotMetaData(self):
+    # Processing parameters of every product, from the primary headers
+    keys = ('NUMINPUT', 'CHRANGE', 'POL', 'RESTFREQ', 'NUMBINS', 'DATE-OBS', 'DATE-END')
+    lines = [f'{product.label}: ' + ', '.join(f'{key}={product.header[key]}' for key in keys if key in product.header) for product in self.products]
+    self.fig.text(0.001, 0.001, '\n'.join(lines), fontsize=8)
@@ -0,0 +1,52 @@
+# Imports
+import os
+import sys
+import subprocess
+import numpy as np
+from astropy.io import fits
+from datetime import datetime, timedelta
+
+# Round trip test of the calibrated store, run with: python -m pytest test_store.py
+# main.py parses its options on import, so it is run as a separate process
+
+SOFTWARE = os.path.dirname(os.path.abspath(__file__))
+
+def WriteFiles(directory, count=6):
+  # Write small synthetic observations of a maser line, one FITS file every 7 hours
+  os.makedirs(directory)
+  rng = np.random.default_rng(0)
+  first = datetime(2024, 3, 1, 18, 0, 0)
+  for idx in range(count):
+    start = first + timedelta(hours=7 * idx)
+    header = fits.Header()
+    header['SAMPRATE'], header['FREQ'], header['TELESCOP'] = 2e6, 6668.5192e6, 'MCA1'
+    header['OBJECT'], header['RA'], header['DEC'] = 'G232', 10.0, 60.0
+    header['EL-BEG'], header['EL-END'], header['AZ-BEG'], header['AZ-END'] = 40.0 + idx, 41.0 + idx, 100.0, 101.0
+    header['DATE-OBS'] = start.strftime('%Y-%m-%dT%H:%M:%S')
+    header['DATE-END'] = (start + timedelta(minutes=20)).strftime('%Y-%m-%dT%H:%M:%S')
+    frequency = 6667.5192e6 + np.arange(4096) * (2e6 / 4096)
+    line = 50 * np.exp(-0.5 * ((np.arange(4096) - 2048) / 6) ** 2)
+    table = fits.BinTableHDU.from_columns([
+      fits.Column('frequency', 'D', array=frequency),
+      fits.Column('rhcpavg', 'E', array=100 + rng.normal(0, 1, 4096) + line),
+      fits.Column('lhcpavg', 'E', array=90 + rng.normal(0, 1, 4096) + 0.8 * line)])
+    fits.HDUList([fits.PrimaryHDU(header=header), table]).writeto(os.path.join(directory, f'G232_{idx:03d}.fits'))
+
+def Run(*args):
+  # Run main.py with the given options and fail with its output if it did not save its result
+  result = subprocess.run([sys.executable, os.path.join(SOFTWARE, 'main.py'), *args], capture_output=True, text=True, cwd=SOFTWARE)
+  assert 'Error' not in result.stdout, result.stdout + result.stderr
+  return result.stdout
+
+def test_store_round_trip_header(tmp_path):
+  # A product re-gridded from a store reports the stored channels, not the default channel range
+  data, store, output = tmp_path / 'data', tmp_path / 'store', tmp_path / 'fromstore.fits'
+  WriteFiles(data)
+  Run('-d', str(data), '-c', '290:3800', '-p', 'r', '-m', '--store', str(store), '--test')
+  Run('--fromstore', str(store), '-o', str(output))
+  with fits.open(output) as hdul:
+    assert hdul[0].header['CHRANGE'] == '290:3800'
+  # A narrower -c selects a subset of the stored channels and is reported as such
+  Run('--fromstore', str(store), '-c', '1000:3000', '-o', str(output))
+  with fits.open(output) as hdul:
+    assert hdul[0].header['CHRANGE'] == '1000:3000'